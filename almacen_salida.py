@@ -0,0 +1,300 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Índice de metadatos dentro del directorio del almacén (los nombres con '.' no son salidas)
+NOMBRE_INDICE = ".indice.sqlite3"
+
+# Un temporal más antiguo que esto es huérfano de una escritura interrumpida; uno más
+# reciente puede pertenecer a una escritura en curso de otro worker
+EDAD_TEMPORAL_HUERFANO = 3600
+
+# Una descarga actualiza el último acceso como máximo una vez por este intervalo: el
+# orden de desalojo por uso no necesita más resolución y las lecturas no escriben
+INTERVALO_ACCESO = 60
+
+class AlmacenSalida:
+    """
+    Almacén de archivos generados por el API.
+
+    - Escrituras atómicas: cada archivo se copia a un temporal dentro del mismo
+      directorio y se publica con os.replace, de modo que un lector nunca ve un
+      archivo a medio escribir aunque dos solicitudes generen el mismo nombre.
+    - Distribución en subdirectorios según el hash del nombre (output/ab/archivo)
+      para que ningún directorio crezca sin límite.
+    - Índice de metadatos (tamaño, registros, fecha de creación, último acceso) en
+      un SQLite dentro del directorio, que atiende /download y el listado sin
+      recorrer el sistema de archivos.
+    - Retención por TTL y por cuota de disco, desalojando primero lo menos usado.
+
+    Todos los workers comparten el mismo índice: el listado y la cuota son globales
+    y SQLite serializa las escrituras entre procesos (BEGIN IMMEDIATE). El índice usa
+    WAL, así que las consultas de /download no esperan a las escrituras ni las bloquean.
+    """
+
+    def __init__(self, directorio="output", max_bytes=None, ttl_segundos=None):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self.ruta_indice = self.directorio / NOMBRE_INDICE
+        self._conexion = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        with self._transaccion() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS archivos ("
+                " nombre TEXT PRIMARY KEY, tamano INTEGER NOT NULL, registros INTEGER,"
+                " creado REAL NOT NULL, ultimo_acceso REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS archivos_ultimo_acceso ON archivos (ultimo_acceso)")
+        self._reconstruir_indice()
+        # Con preload el almacén se crea en el proceso maestro: no dejar una conexión
+        # abierta que los workers hereden por fork
+        self._cerrar()
+
+    @staticmethod
+    def _validar_nombre(nombre):
+        if not nombre or nombre != Path(nombre).name or nombre.startswith('.'):
+            raise ValueError(f"Nombre de archivo no válido: {nombre}")
+
+    def ruta_para(self, nombre):
+        """Ruta definitiva de un archivo dentro del almacén"""
+        self._validar_nombre(nombre)
+        fragmento = hashlib.sha1(nombre.encode('utf-8')).hexdigest()[:2]
+        return self.directorio / fragmento / nombre
+
+    def _ruta_existente(self, nombre):
+        """
+        Ruta en disco de un archivo del almacén.
+
+        Los archivos del formato plano anterior (output/archivo.avro) se resuelven en su
+        lugar, sin moverlos; si existe la copia distribuida por hash, esa tiene prioridad.
+        """
+        ruta = self.ruta_para(nombre)
+        if not ruta.is_file():
+            plana = self.directorio / nombre
+            if plana.is_file():
+                return plana
+        return ruta
+
+    def _conectar(self):
+        # Una conexión por proceso; la heredada por fork no se reutiliza
+        if self._conexion is None or self._pid != os.getpid():
+            self._conexion = sqlite3.connect(self.ruta_indice, timeout=30, isolation_level=None,
+                                             check_same_thread=False)
+            self._conexion.row_factory = sqlite3.Row
+            # WAL: lectores concurrentes con un escritor; NORMAL no sincroniza el disco en
+            # cada commit (un corte de energía puede perder los últimos cambios, que
+            # _reconstruir_indice recupera del directorio al iniciar)
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._conexion
+
+    def _cerrar(self):
+        with self._lock:
+            if self._conexion is not None and self._pid == os.getpid():
+                self._conexion.close()
+            self._conexion = None
+
+    @contextlib.contextmanager
+    def _transaccion(self):
+        """Transacción de escritura exclusiva entre hilos y procesos"""
+        with self._lock:
+            db = self._conectar()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def _reconstruir_indice(self):
+        # Único recorrido del directorio, al iniciar el proceso: incorpora archivos
+        # que no están en el índice y descarta entradas cuyo archivo ya no existe
+        encontrados = set()
+        for ruta in self.directorio.rglob('*'):
+            if not ruta.is_file():
+                continue
+            if ruta.name.startswith('.'):
+                # Índice, su journal o temporales de escrituras (huérfanos si son antiguos)
+                if ruta.name.endswith('.tmp') and time.time() - ruta.stat().st_mtime > EDAD_TEMPORAL_HUERFANO:
+                    ruta.unlink(missing_ok=True)
+                continue
+            # Solo su subdirectorio por hash o, en el formato plano anterior, la raíz
+            if ruta.parent == self.directorio or ruta == self.ruta_para(ruta.name):
+                encontrados.add(ruta.name)
+        with self._transaccion() as db:
+            conocidos = {fila['nombre'] for fila in db.execute("SELECT nombre FROM archivos")}
+            for nombre in conocidos - encontrados:
+                db.execute("DELETE FROM archivos WHERE nombre = ?", (nombre,))
+            for nombre in encontrados - conocidos:
+                self._registrar(db, self._ruta_existente(nombre))
+
+    def _registrar(self, db, ruta, registros=None):
+        stat = ruta.stat()
+        metadatos = {
+            'nombre': ruta.name,
+            'tamano': stat.st_size,
+            'registros': registros,
+            'creado': stat.st_mtime,
+            'ultimo_acceso': time.time(),
+        }
+        db.execute(
+            "INSERT OR REPLACE INTO archivos (nombre, tamano, registros, creado, ultimo_acceso)"
+            " VALUES (:nombre, :tamano, :registros, :creado, :ultimo_acceso)",
+            metadatos
+        )
+        return metadatos
+
+    def _copiar_temporal(self, origen, destino):
+        """Copia origen a un temporal oculto junto a destino, listo para publicarse con os.replace"""
+        destino.parent.mkdir(exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=destino.parent, prefix=f".{destino.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out, open(origen, 'rb') as src:
+                shutil.copyfileobj(src, out)
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            Path(temporal).unlink(missing_ok=True)
+            raise
+        return temporal
+
+    def guardar(self, origen, nombre, registros=None, proteger=()):
+        """
+        Copia origen al almacén de forma atómica y devuelve sus metadatos.
+
+        proteger lista otros nombres que no se desalojan por cuota en esta escritura
+        (p. ej. las partes ya publicadas de la misma conversión).
+        """
+        destino = self.ruta_para(nombre)
+        temporal = self._copiar_temporal(origen, destino)
+        try:
+            os.replace(temporal, destino)
+        except BaseException:
+            Path(temporal).unlink(missing_ok=True)
+            raise
+        with self._transaccion() as db:
+            metadatos = self._registrar(db, destino, registros)
+            self._desalojar(db, proteger={nombre, *proteger})
+            return metadatos
+
+    def guardar_manifiesto(self, origen, nombre, proteger=()):
+        """
+        Publica el manifiesto de una salida dividida en partes y devuelve sus metadatos.
+
+        Las partes que listaba el manifiesto reemplazado y que el nuevo no incluye se
+        eliminan. Leer el manifiesto anterior, reemplazarlo y eliminar sus partes ocurre
+        en una sola transacción: entre conversiones concurrentes de la misma salida gana
+        la última en publicar y no quedan partes de conjuntos sustituidos.
+        """
+        destino = self.ruta_para(nombre)
+        vigentes = self._partes_manifiesto(origen)
+        temporal = self._copiar_temporal(origen, destino)
+        try:
+            with self._transaccion() as db:
+                anteriores = self._partes_manifiesto(self._ruta_existente(nombre))
+                os.replace(temporal, destino)
+                metadatos = self._registrar(db, destino)
+                for parte in anteriores - vigentes:
+                    self._eliminar(db, parte)
+                self._desalojar(db, proteger={nombre, *vigentes, *proteger})
+                return metadatos
+        finally:
+            Path(temporal).unlink(missing_ok=True)
+
+    @staticmethod
+    def _partes_manifiesto(ruta):
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                return {parte['archivo'] for parte in json.load(f).get('partes', [])}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return set()
+
+    def obtener(self, nombre):
+        """Metadatos y ruta de un archivo, o None si no existe o expiró"""
+        try:
+            ruta = self._ruta_existente(nombre)
+        except ValueError:
+            return None
+        # Consulta sin transacción de escritura; solo se escribe si hay algo que cambiar
+        with self._lock:
+            fila = self._conectar().execute("SELECT * FROM archivos WHERE nombre = ?", (nombre,)).fetchone()
+        if fila is None:
+            # Copiado al directorio sin pasar por el almacén: una sola consulta, sin recorrer
+            if not ruta.is_file():
+                return None
+            with self._transaccion() as db:
+                metadatos = self._registrar(db, ruta)
+            return dict(metadatos, ruta=str(ruta))
+        if self._expirado(fila) or not ruta.is_file():
+            with self._transaccion() as db:
+                # Otro worker pudo volver a publicarlo entre la consulta y esta transacción
+                fila = db.execute("SELECT * FROM archivos WHERE nombre = ?", (nombre,)).fetchone()
+                if fila is not None and (self._expirado(fila) or not ruta.is_file()):
+                    self._eliminar(db, nombre)
+            return None
+        metadatos = dict(fila)
+        ahora = time.time()
+        if ahora - metadatos['ultimo_acceso'] >= INTERVALO_ACCESO:
+            metadatos['ultimo_acceso'] = ahora
+            with self._transaccion() as db:
+                db.execute("UPDATE archivos SET ultimo_acceso = ? WHERE nombre = ?", (ahora, nombre))
+        return dict(metadatos, ruta=str(ruta))
+
+    def listar(self):
+        """Metadatos de todos los archivos vigentes, del más reciente al más antiguo"""
+        with self._transaccion() as db:
+            self._desalojar(db)
+            return [dict(fila) for fila in db.execute("SELECT * FROM archivos ORDER BY creado DESC")]
+
+    def eliminar(self, nombre):
+        with self._transaccion() as db:
+            return self._eliminar(db, nombre)
+
+    def _eliminar(self, db, nombre):
+        if db.execute("DELETE FROM archivos WHERE nombre = ?", (nombre,)).rowcount == 0:
+            return False
+        self.ruta_para(nombre).unlink(missing_ok=True)
+        # Una copia del formato plano anterior volvería a resolverse con este nombre
+        (self.directorio / nombre).unlink(missing_ok=True)
+        return True
+
+    def _expirado(self, metadatos):
+        return bool(self.ttl_segundos) and time.time() - metadatos['creado'] > self.ttl_segundos
+
+    def _desalojar(self, db, proteger=()):
+        if self.ttl_segundos:
+            limite = time.time() - self.ttl_segundos
+            for fila in db.execute("SELECT nombre FROM archivos WHERE creado < ?", (limite,)).fetchall():
+                if fila['nombre'] not in proteger:
+                    self._eliminar(db, fila['nombre'])
+        if not self.max_bytes:
+            return
+        total = self._total_bytes(db)
+        # Primero lo menos usado recientemente
+        for fila in db.execute("SELECT nombre, tamano FROM archivos ORDER BY ultimo_acceso").fetchall():
+            if total <= self.max_bytes:
+                break
+            if fila['nombre'] not in proteger:
+                self._eliminar(db, fila['nombre'])
+                total -= fila['tamano']
+
+    @staticmethod
+    def _total_bytes(db):
+        return db.execute("SELECT COALESCE(SUM(tamano), 0) FROM archivos").fetchone()[0]
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return self._total_bytes(self._conectar())
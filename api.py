@@ -1,13 +1,105 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import FileResponse
+import time
+_INICIO_IMPORTACION = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Header
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import tempfile
+import threading
+import contextlib
 import os
 import json
 from pathlib import Path
 import shutil
-from generadorcsvavro import GeneradorCsvAvro
+import secrets
+import asyncio
+import concurrent.futures
+from io import BytesIO, StringIO
+import fastavro
+from generadorcsvavro import GeneradorCsvAvro, cargar_schema, COLUMNAS_CLAVE
+from almacen_salida import AlmacenSalida
+from catalogos import registro_catalogos
+
+DEFAULT_SCHEMA_PATH = Path("Esquema_AVRO.json")
+
+def _entero_env(nombre):
+    valor = os.environ.get(nombre)
+    return int(valor) if valor else None
+
+# Columnas cuya combinación debe ser única en el archivo (COLUMNAS_CLAVE="" desactiva)
+if "COLUMNAS_CLAVE" in os.environ:
+    COLUMNAS_CLAVE = tuple(c.strip() for c in os.environ["COLUMNAS_CLAVE"].split(",") if c.strip())
+
+# Token de administración para opciones restringidas (p. ej. profile=true); sin él quedan deshabilitadas
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Almacén de archivos generados: OUTPUT_MAX_BYTES y OUTPUT_TTL_SECONDS son opcionales
+almacen = AlmacenSalida(
+    directorio=os.environ.get("OUTPUT_DIR", "output"),
+    max_bytes=_entero_env("OUTPUT_MAX_BYTES"),
+    ttl_segundos=_entero_env("OUTPUT_TTL_SECONDS")
+)
+
+# Métricas de arranque del proceso: tiempo de importación, precalentamiento y
+# latencia de la primera conversión atendida por cada worker.
+METRICAS_ARRANQUE = {
+    "importacion_s": None,
+    "precalentamiento_s": None,
+    "primera_conversion_s": None,
+    "pid": os.getpid(),
+}
+
+def _csv_precalentamiento(generador):
+    """CSV de una fila que pasa las validaciones del esquema del generador"""
+    campos = [field['name'] for field in generador._obtener_detalle_schema()['fields']]
+    valores = []
+    for campo in campos:
+        if campo in generador.catalogos:
+            valores.append('')  # Un código inventado no estaría en el catálogo
+        elif campo in generador.enums_detalle:
+            valores.append(generador.enums_detalle[campo][1][0])
+        elif campo in generador.numericos_detalle:
+            valores.append('1')
+        else:
+            valores.append('x')
+    return f"{';'.join(campos)}\n{';'.join(valores)}\n"
+
+def precalentar():
+    """
+    Ejecuta una conversión mínima con el esquema por defecto.
+
+    Recorre el mismo camino que una solicitud (lectura por bloques con columnas
+    categóricas, catálogos, reglas, validación y escritura con fastavro). En modo
+    producción se invoca en el proceso maestro antes de crear los workers, de modo
+    que estos heredan las páginas ya inicializadas (copy-on-write) y la primera
+    conversión no paga el costo de inicialización.
+    """
+    inicio = time.perf_counter()
+    # Catálogos de referencia cargados antes del fork quedan compartidos entre workers
+    registro_catalogos.catalogos()
+    if DEFAULT_SCHEMA_PATH.exists():
+        schema = cargar_schema(DEFAULT_SCHEMA_PATH)
+        # Escribir un contenedor vacío inicializa las rutas de código de fastavro
+        fastavro.writer(BytesIO(), schema, [])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            csv_path = Path(temp_dir) / "precalentamiento.csv"
+            generador = GeneradorCsvAvro(
+                tipo_entidad=1,
+                codigo_entidad="0",
+                nombre_entidad="PRECALENTAMIENTO",
+                fecha_corte=0,
+                ruta_schema=str(DEFAULT_SCHEMA_PATH),
+                ruta_csv=str(csv_path),
+                columnas_clave=COLUMNAS_CLAVE
+            )
+            csv_path.write_text(_csv_precalentamiento(generador), encoding="utf-8")
+            # La conversión imprime su resumen; no es información útil en el arranque
+            with contextlib.redirect_stdout(StringIO()):
+                generador.ejecutar(str(Path(temp_dir) / "precalentamiento.avro"),
+                                   str(Path(temp_dir) / "precalentamiento.log"))
+    METRICAS_ARRANQUE["precalentamiento_s"] = round(time.perf_counter() - inicio, 4)
+    return METRICAS_ARRANQUE
 
 app = FastAPI(
     title="Convertidor CSV a AVRO",
@@ -15,6 +107,31 @@ app = FastAPI(
     version="1.0.0"
 )
 
+METRICAS_ARRANQUE["importacion_s"] = round(time.perf_counter() - _INICIO_IMPORTACION, 4)
+
+@contextlib.contextmanager
+def _medir_primera_conversion(ruta):
+    """
+    Registra la latencia de la primera conversión atendida por este proceso.
+
+    Se usa en /convert y /convert-with-default-schema, que responden al terminar (en
+    /convert-stream la respuesta empieza antes de convertir). Una conversión que falla
+    no cuenta.
+    """
+    # Un worker creado por fork hereda las métricas del maestro; reiniciar la medición
+    if METRICAS_ARRANQUE["pid"] != os.getpid():
+        METRICAS_ARRANQUE["pid"] = os.getpid()
+        METRICAS_ARRANQUE["primera_conversion_s"] = None
+    if METRICAS_ARRANQUE["primera_conversion_s"] is not None:
+        yield
+        return
+    inicio = time.perf_counter()
+    yield
+    if METRICAS_ARRANQUE["primera_conversion_s"] is None:
+        METRICAS_ARRANQUE["primera_conversion_s"] = round(time.perf_counter() - inicio, 4)
+        print(f"⏱️  Worker {os.getpid()}: primera conversión {ruta} "
+              f"en {METRICAS_ARRANQUE['primera_conversion_s']}s")
+
 class ConversionRequest(BaseModel):
     tipo_entidad: int
     codigo_entidad: str
@@ -28,6 +145,10 @@ class ConversionResponse(BaseModel):
     registros_invalidos: int
     inconsistencias: Optional[list] = None
     avro_file_path: Optional[str] = None
+    estadisticas: Optional[Dict[str, Any]] = None
+    perfil_file_path: Optional[str] = None
+    manifest_file_path: Optional[str] = None
+    partes: Optional[list] = None
 
 @app.get("/")
 async def root():
@@ -39,6 +160,8 @@ async def root():
         "endpoints": {
             "convert": "/convert - POST - Convierte CSV a AVRO",
             "health": "/health - GET - Estado del servicio",
+            "files": "/files - GET - Lista los archivos generados",
+            "convert-stream": "/convert-stream - POST - Convierte CSV a AVRO con progreso (SSE)",
             "docs": "/docs - Documentación interactiva"
         }
     }
@@ -46,7 +169,92 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Endpoint de verificación de salud del servicio"""
-    return {"status": "healthy", "service": "csv-to-avro-converter"}
+    return {"status": "healthy", "service": "csv-to-avro-converter", "arranque": METRICAS_ARRANQUE}
+
+def _verificar_admin(x_admin_token):
+    """Rechaza la solicitud si el token de administración no coincide"""
+    # compare_digest con str solo admite ASCII: se comparan bytes para responder 403 y no 500
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        raise HTTPException(status_code=403, detail="Opción reservada a administradores")
+
+def _procesar_conversion(generador, avro_path, log_path, nombre_salida, mensaje_exito, perfilar=False):
+    """Ejecuta la conversión y publica el AVRO resultante en el almacén de salida"""
+    # Las partes y el manifiesto toman su nombre del archivo de salida
+    avro_path = avro_path.with_name(nombre_salida)
+    # Ejecutar conversión (opcionalmente con perfil por muestreo)
+    perfil_path = avro_path.with_suffix('.folded') if perfilar else None
+    generador.ejecutar(str(avro_path), str(log_path), str(perfil_path) if perfil_path else None)
+
+    # El perfil se publica junto a la salida aunque no se haya generado el AVRO
+    perfil_file_path = None
+    if perfil_path and perfil_path.exists():
+        perfil_file_path = almacen.guardar(perfil_path, f"{Path(nombre_salida).stem}.perfil.folded")['nombre']
+
+    # Leer inconsistencias si existen
+    inconsistencias = []
+    if log_path.exists():
+        with open(log_path, 'r', encoding='utf-8') as f:
+            inconsistencias = [line.strip() for line in f.readlines()]
+
+    return _publicar_resultado(generador, avro_path, mensaje_exito, inconsistencias, perfil_file_path)
+
+def _publicar_resultado(generador, avro_path, mensaje_exito, inconsistencias=None, perfil_file_path=None):
+    """
+    Publica en el almacén la salida de una conversión ya ejecutada y arma la respuesta.
+
+    Sin lista de inconsistencias (modo streaming) solo se informa su total.
+    """
+    nombre_salida = avro_path.name
+
+    # Contar registros
+    registros_validos = len(generador.garantias) if hasattr(generador, 'garantias') else 0
+    registros_invalidos = len(inconsistencias) if inconsistencias is not None else generador.total_inconsistencias
+
+    if generador.partes:
+        # Primero las partes y al final el manifiesto: quien lee el manifiesto
+        # encuentra todas sus partes publicadas. El conjunto completo queda protegido
+        # de la cuota mientras se publica, para no desalojar una parte ya copiada, y al
+        # publicar el manifiesto se eliminan las partes del conjunto que reemplaza
+        conjunto = {parte['archivo'] for parte in generador.partes} | {generador.ruta_manifiesto.name}
+        for parte in generador.partes:
+            almacen.guardar(avro_path.with_name(parte['archivo']), parte['archivo'],
+                            registros=parte['registros'], proteger=conjunto)
+        manifiesto = almacen.guardar_manifiesto(generador.ruta_manifiesto, generador.ruta_manifiesto.name, proteger=conjunto)
+
+        return ConversionResponse(
+            success=True,
+            message=f"{mensaje_exito} ({len(generador.partes)} partes)",
+            registros_validos=registros_validos,
+            registros_invalidos=registros_invalidos,
+            inconsistencias=inconsistencias if inconsistencias else None,
+            estadisticas=generador.estadisticas,
+            perfil_file_path=perfil_file_path,
+            manifest_file_path=manifiesto['nombre'],
+            partes=[{k: p[k] for k in ('archivo', 'registros', 'bytes')} for p in generador.partes]
+        )
+    elif avro_path.exists():
+        # Publicación atómica: un lector nunca ve el archivo a medio copiar
+        metadatos = almacen.guardar(avro_path, nombre_salida, registros=registros_validos)
+
+        return ConversionResponse(
+            success=True,
+            message=mensaje_exito,
+            registros_validos=registros_validos,
+            registros_invalidos=registros_invalidos,
+            inconsistencias=inconsistencias if inconsistencias else None,
+            avro_file_path=metadatos['nombre'],  # Solo el nombre del archivo
+            estadisticas=generador.estadisticas,
+            perfil_file_path=perfil_file_path
+        )
+    else:
+        return ConversionResponse(
+            success=False,
+            message="Error: No se pudo generar el archivo AVRO",
+            registros_validos=0,
+            registros_invalidos=registros_invalidos,
+            inconsistencias=inconsistencias,
+            perfil_file_path=perfil_file_path
+        )
 
 @app.post("/convert", response_model=ConversionResponse)
 async def convert_csv_to_avro(
@@ -54,8 +262,12 @@ async def convert_csv_to_avro(
     codigo_entidad: str = Form(...),
     nombre_entidad: str = Form(...),
     fecha_corte: int = Form(...),
+    max_registros_por_parte: Optional[int] = Form(None, ge=1),
+    max_bytes_por_parte: Optional[int] = Form(None, ge=1),
     csv_file: UploadFile = File(...),
-    schema_file: UploadFile = File(...)
+    schema_file: UploadFile = File(...),
+    profile: bool = Query(False),
+    x_admin_token: Optional[str] = Header(None)
 ):
     """
     Convierte un archivo CSV a formato AVRO usando el esquema proporcionado
@@ -66,8 +278,15 @@ async def convert_csv_to_avro(
     - **fecha_corte**: Fecha de corte (int)
     - **csv_file**: Archivo CSV a convertir
     - **schema_file**: Archivo de esquema AVRO en formato JSON
+    - **max_registros_por_parte** / **max_bytes_por_parte**: (opcionales) dividen la salida en
+      archivos AVRO independientes con un manifiesto que lista las partes
+    - **profile**: (solo administradores, cabecera `X-Admin-Token`) guarda un perfil por
+      muestreo de la conversión en formato de pilas colapsadas, descargable desde /download
     """
     
+    if profile:
+        _verificar_admin(x_admin_token)
+    
     # Validar tipos de archivo
     if not csv_file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="El archivo debe ser un CSV")
@@ -105,77 +324,66 @@ async def convert_csv_to_avro(
                 nombre_entidad=nombre_entidad,
                 fecha_corte=fecha_corte,
                 ruta_schema=str(schema_path),
-                ruta_csv=str(csv_path)
+                ruta_csv=str(csv_path),
+                columnas_clave=COLUMNAS_CLAVE,
+                max_registros_por_parte=max_registros_por_parte,
+                max_bytes_por_parte=max_bytes_por_parte
             )
             
-            # Ejecutar conversión
-            generador.ejecutar(str(avro_path), str(log_path))
-            
-            # Leer inconsistencias si existen
-            inconsistencias = []
-            if log_path.exists():
-                with open(log_path, 'r', encoding='utf-8') as f:
-                    inconsistencias = [line.strip() for line in f.readlines()]
-            
-            # Contar registros
-            registros_validos = len(generador.garantias) if hasattr(generador, 'garantias') else 0
-            registros_invalidos = len(inconsistencias)
-            
-            # Copiar archivo AVRO a ubicación permanente (opcional)
-            output_dir = Path("output")
-            output_dir.mkdir(exist_ok=True)
-            final_avro_path = output_dir / f"converted_{tipo_entidad}_{codigo_entidad}_{fecha_corte}.avro"
-            
-            if avro_path.exists():
-                shutil.copy2(avro_path, final_avro_path)
-                
-                # Solo devolver el nombre del archivo, no la ruta completa
-                filename_only = final_avro_path.name
-                
-                return ConversionResponse(
-                    success=True,
-                    message="Conversión completada exitosamente",
-                    registros_validos=registros_validos,
-                    registros_invalidos=registros_invalidos,
-                    inconsistencias=inconsistencias if inconsistencias else None,
-                    avro_file_path=filename_only  # Solo el nombre del archivo
-                )
-            else:
-                return ConversionResponse(
-                    success=False,
-                    message="Error: No se pudo generar el archivo AVRO",
-                    registros_validos=0,
-                    registros_invalidos=registros_invalidos,
-                    inconsistencias=inconsistencias
+            with _medir_primera_conversion("/convert"):
+                return _procesar_conversion(
+                    generador, avro_path, log_path,
+                    f"converted_{tipo_entidad}_{codigo_entidad}_{fecha_corte}.avro",
+                    "Conversión completada exitosamente",
+                    perfilar=profile
                 )
                 
+        except HTTPException:
+            raise
         except ValueError as e:
             raise HTTPException(status_code=400, detail=f"Error de validación: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
+def download_file(filename: str):
     """
-    Descarga un archivo AVRO generado
+    Descarga un archivo generado: AVRO completo, una parte o el manifiesto de partes
     """
-    file_path = Path("output") / filename
+    # Endpoint síncrono: FastAPI lo ejecuta en su pool de hilos, así que la consulta al
+    # índice (que puede esperar a otro worker) no bloquea el event loop
+    metadatos = almacen.obtener(filename)
     
-    if not file_path.exists():
+    if metadatos is None:
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     
     return FileResponse(
-        path=str(file_path),
+        path=metadatos['ruta'],
         filename=filename,
-        media_type='application/octet-stream'
+        media_type='application/json' if filename.endswith('.json') else 'application/octet-stream'
     )
 
+@app.get("/files")
+def list_files():
+    """
+    Lista los archivos generados disponibles para descarga (desde el índice compartido)
+    """
+    archivos = almacen.listar()
+    return {
+        "archivos": archivos,
+        "total_archivos": len(archivos),
+        "total_bytes": almacen.total_bytes,
+        "cuota_bytes": almacen.max_bytes
+    }
+
 @app.post("/convert-with-default-schema")
 async def convert_with_default_schema(
     tipo_entidad: int = Form(...),
     codigo_entidad: str = Form(...),
     nombre_entidad: str = Form(...),
     fecha_corte: int = Form(...),
+    max_registros_por_parte: Optional[int] = Form(None, ge=1),
+    max_bytes_por_parte: Optional[int] = Form(None, ge=1),
     csv_file: UploadFile = File(...)
 ):
     """
@@ -186,7 +394,7 @@ async def convert_with_default_schema(
         raise HTTPException(status_code=400, detail="El archivo debe ser un CSV")
     
     # Verificar que existe el esquema por defecto
-    default_schema_path = Path("Esquema_AVRO.json")
+    default_schema_path = DEFAULT_SCHEMA_PATH
     if not default_schema_path.exists():
         raise HTTPException(status_code=404, detail="Esquema por defecto no encontrado")
     
@@ -207,52 +415,140 @@ async def convert_with_default_schema(
                 nombre_entidad=nombre_entidad,
                 fecha_corte=fecha_corte,
                 ruta_schema=str(default_schema_path),
-                ruta_csv=str(csv_path)
+                ruta_csv=str(csv_path),
+                columnas_clave=COLUMNAS_CLAVE,
+                max_registros_por_parte=max_registros_por_parte,
+                max_bytes_por_parte=max_bytes_por_parte
             )
             
-            # Ejecutar conversión
-            generador.ejecutar(str(avro_path), str(log_path))
-            
-            # Leer inconsistencias
-            inconsistencias = []
-            if log_path.exists():
-                with open(log_path, 'r', encoding='utf-8') as f:
-                    inconsistencias = [line.strip() for line in f.readlines()]
-            
-            registros_validos = len(generador.garantias) if hasattr(generador, 'garantias') else 0
-            registros_invalidos = len(inconsistencias)
-            
-            # Guardar archivo AVRO
-            output_dir = Path("output")
-            output_dir.mkdir(exist_ok=True)
-            final_avro_path = output_dir / f"converted_default_{tipo_entidad}_{codigo_entidad}_{fecha_corte}.avro"
-            
-            if avro_path.exists():
-                shutil.copy2(avro_path, final_avro_path)
-                
-                # Solo devolver el nombre del archivo, no la ruta completa
-                filename_only = final_avro_path.name
-                
-                return ConversionResponse(
-                    success=True,
-                    message="Conversión completada con esquema por defecto",
-                    registros_validos=registros_validos,
-                    registros_invalidos=registros_invalidos,
-                    inconsistencias=inconsistencias if inconsistencias else None,
-                    avro_file_path=filename_only  # Solo el nombre del archivo
-                )
-            else:
-                return ConversionResponse(
-                    success=False,
-                    message="Error: No se pudo generar el archivo AVRO",
-                    registros_validos=0,
-                    registros_invalidos=registros_invalidos,
-                    inconsistencias=inconsistencias
+            with _medir_primera_conversion("/convert-with-default-schema"):
+                return _procesar_conversion(
+                    generador, avro_path, log_path,
+                    f"converted_default_{tipo_entidad}_{codigo_entidad}_{fecha_corte}.avro",
+                    "Conversión completada con esquema por defecto"
                 )
                 
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
+@app.post("/convert-stream")
+async def convert_stream(
+    tipo_entidad: int = Form(...),
+    codigo_entidad: str = Form(...),
+    nombre_entidad: str = Form(...),
+    fecha_corte: int = Form(...),
+    max_registros_por_parte: Optional[int] = Form(None, ge=1),
+    max_bytes_por_parte: Optional[int] = Form(None, ge=1),
+    csv_file: UploadFile = File(...),
+    schema_file: Optional[UploadFile] = File(None)
+):
+    """
+    Convierte un CSV a AVRO informando el avance como Server-Sent Events
+
+    Eventos emitidos (`event:` + `data:` JSON):
+    - **progreso**: fase, filas leídas, convertidas, válidas e inválidas tras convertir y
+      tras validar cada lote
+    - **inconsistencias**: lote de inconsistencias apenas se detectan
+    - **resultado**: respuesta final de la conversión (sin la lista de inconsistencias)
+    - **error**: la conversión falló
+
+    Sin `schema_file` se usa el esquema por defecto.
+    """
+    if not csv_file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="El archivo debe ser un CSV")
+    if schema_file is not None and not schema_file.filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="El esquema debe ser un archivo JSON")
+    if schema_file is None and not DEFAULT_SCHEMA_PATH.exists():
+        raise HTTPException(status_code=404, detail="Esquema por defecto no encontrado")
+
+    # Los archivos se copian antes de responder: el directorio vive hasta que termina el stream
+    temp_dir = tempfile.TemporaryDirectory()
+    try:
+        csv_path = Path(temp_dir.name) / "input.csv"
+        log_path = Path(temp_dir.name) / "inconsistencias.log"
+        with open(csv_path, "wb") as f:
+            shutil.copyfileobj(csv_file.file, f)
+        if schema_file is not None:
+            schema_path = Path(temp_dir.name) / "schema.json"
+            with open(schema_path, "wb") as f:
+                shutil.copyfileobj(schema_file.file, f)
+            try:
+                with open(schema_path, 'r', encoding='utf-8') as f:
+                    json.load(f)
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="El archivo de esquema no es un JSON válido")
+            prefijo = "converted"
+        else:
+            schema_path = DEFAULT_SCHEMA_PATH
+            prefijo = "converted_default"
+        avro_path = Path(temp_dir.name) / f"{prefijo}_{tipo_entidad}_{codigo_entidad}_{fecha_corte}.avro"
+    except BaseException:
+        temp_dir.cleanup()
+        raise
+
+    loop = asyncio.get_running_loop()
+    # Cola acotada: si el cliente lee lento, la conversión espera en lugar de acumular eventos
+    cola = asyncio.Queue(maxsize=64)
+    cancelado = threading.Event()
+    fin = object()
+
+    def notificar(evento):
+        while not cancelado.is_set():
+            futuro = asyncio.run_coroutine_threadsafe(cola.put(evento), loop)
+            try:
+                futuro.result(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                if not futuro.cancel():
+                    return
+        raise RuntimeError("Conversión cancelada: el cliente cerró la conexión")
+
+    def convertir():
+        try:
+            generador = GeneradorCsvAvro(
+                tipo_entidad=tipo_entidad,
+                codigo_entidad=codigo_entidad,
+                nombre_entidad=nombre_entidad,
+                fecha_corte=fecha_corte,
+                ruta_schema=str(schema_path),
+                ruta_csv=str(csv_path),
+                columnas_clave=COLUMNAS_CLAVE,
+                max_registros_por_parte=max_registros_por_parte,
+                max_bytes_por_parte=max_bytes_por_parte
+            )
+            generador.ejecutar(str(avro_path), str(log_path), notificar=notificar)
+            respuesta = _publicar_resultado(generador, avro_path, "Conversión completada exitosamente")
+            notificar({'evento': 'resultado', **respuesta.model_dump()})
+        except Exception as e:
+            if not cancelado.is_set():
+                notificar({'evento': 'error', 'detail': f"Error interno: {str(e)}"})
+        finally:
+            if not cancelado.is_set():
+                notificar(fin)
+
+    async def eventos():
+        tarea = loop.run_in_executor(None, convertir)
+        try:
+            while True:
+                evento = await cola.get()
+                if evento is fin:
+                    break
+                tipo = evento.pop('evento')
+                yield f"event: {tipo}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+        finally:
+            # Cliente desconectado o stream terminado: detener la conversión y limpiar
+            cancelado.set()
+            try:
+                await tarea
+            finally:
+                temp_dir.cleanup()
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directorio de catálogos de referencia y archivo base (sin extensión) de cada campo.
+# Cada catálogo es un CSV separado por ';' cuya primera columna son los códigos válidos,
+# o un .npy con el arreglo ordenado (se abre con mmap y lo comparten todos los workers).
+DIRECTORIO_CATALOGOS = Path(os.environ.get("DIRECTORIO_CATALOGOS", "Catalogos"))
+CATALOGOS_POR_CAMPO = {
+    "DIVIPOLA": "DIVIPOLA",
+    "CODIGO_CIIU": "CODIGO_CIIU",
+    "NIT_INTERMEDIARIO": "NIT_INTERMEDIARIO",
+}
+
+class CatalogoReferencia:
+    """Códigos válidos de un catálogo como arreglo numérico ordenado y sin repetidos"""
+
+    def __init__(self, nombre, codigos, ruta=None):
+        self.nombre = nombre
+        self.codigos = codigos
+        self.ruta = ruta
+
+    @classmethod
+    def desde_archivo(cls, nombre, ruta):
+        ruta = Path(ruta)
+        if ruta.suffix == '.npy':
+            # Se asume ya ordenado y sin repetidos (ver compilar_catalogo)
+            codigos = np.load(ruta, mmap_mode='r')
+        else:
+            columna = pd.read_csv(ruta, sep=';', dtype=str, usecols=[0]).iloc[:, 0]
+            codigos = np.unique(pd.to_numeric(columna, errors='coerce').dropna().to_numpy(dtype='float64'))
+        return cls(nombre, codigos, ruta)
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def contiene(self, valores):
+        """
+        Prueba de pertenencia vectorizada (búsqueda binaria sobre el arreglo ordenado).
+
+        valores es una Serie de textos del CSV; los valores no numéricos no pertenecen.
+        """
+        numeros = pd.to_numeric(valores, errors='coerce').to_numpy(dtype='float64')
+        if len(self.codigos) == 0:
+            return np.zeros(len(numeros), dtype=bool)
+        posiciones = np.searchsorted(self.codigos, numeros)
+        posiciones = np.minimum(posiciones, len(self.codigos) - 1)
+        return self.codigos[posiciones] == numeros
+
+def compilar_catalogo(ruta_csv):
+    """
+    Genera junto al CSV un .npy ordenado que luego se abre con mmap.
+
+    El arreglo se escribe en un temporal y se publica con os.replace: los workers que
+    tienen abierto el .npy anterior siguen leyendo ese archivo (otro inodo) hasta recargar.
+    """
+    ruta_csv = Path(ruta_csv)
+    catalogo = CatalogoReferencia.desde_archivo(ruta_csv.stem, ruta_csv)
+    ruta_npy = ruta_csv.with_suffix('.npy')
+    fd, temporal = tempfile.mkstemp(dir=ruta_npy.parent, prefix=f".{ruta_npy.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(catalogo.codigos))
+        os.replace(temporal, ruta_npy)
+    except BaseException:
+        Path(temporal).unlink(missing_ok=True)
+        raise
+    return ruta_npy
+
+class RegistroCatalogos:
+    """
+    Catálogos cargados una vez por proceso.
+
+    Cada catálogo se recarga si su archivo cambia en disco (se verifica como máximo
+    cada intervalo_verificacion segundos), sin necesidad de reiniciar el servicio.
+    """
+
+    def __init__(self, directorio=DIRECTORIO_CATALOGOS, catalogos_por_campo=None, intervalo_verificacion=30):
+        self.directorio = Path(directorio)
+        self.catalogos_por_campo = catalogos_por_campo or CATALOGOS_POR_CAMPO
+        self.intervalo_verificacion = intervalo_verificacion
+        self._catalogos = {}
+        self._firmas = {}
+        self._ultima_verificacion = None
+        self._lock = threading.Lock()
+
+    def _ruta(self, base):
+        # El .npy compilado se prefiere mientras no sea más antiguo que el CSV: un CSV
+        # editado después de compilar se usa directamente hasta volver a compilarlo
+        rutas = []
+        for extension in ('.npy', '.csv'):
+            ruta = self.directorio / f"{base}{extension}"
+            try:
+                rutas.append((ruta.stat().st_mtime_ns, ruta))
+            except OSError:
+                continue
+        if not rutas:
+            return None
+        return max(rutas, key=lambda par: par[0])[1]
+
+    def _verificar(self):
+        for campo, base in self.catalogos_por_campo.items():
+            ruta = self._ruta(base)
+            if ruta is None:
+                self._catalogos.pop(campo, None)
+                self._firmas.pop(campo, None)
+                continue
+            stat = ruta.stat()
+            firma = (str(ruta), stat.st_mtime_ns, stat.st_size)
+            if self._firmas.get(campo) != firma:
+                self._catalogos[campo] = CatalogoReferencia.desde_archivo(campo, ruta)
+                self._firmas[campo] = firma
+
+    def catalogos(self):
+        """Diccionario campo -> CatalogoReferencia con los catálogos disponibles"""
+        with self._lock:
+            ahora = time.monotonic()
+            if self._ultima_verificacion is None or ahora - self._ultima_verificacion >= self.intervalo_verificacion:
+                self._verificar()
+                self._ultima_verificacion = ahora
+            return dict(self._catalogos)
+
+    def recargar(self):
+        with self._lock:
+            self._verificar()
+            self._ultima_verificacion = time.monotonic()
+            return dict(self._catalogos)
+
+# Registro compartido por todas las conversiones del proceso
+registro_catalogos = RegistroCatalogos()
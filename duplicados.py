@@ -0,0 +1,140 @@
+import heapq
+import os
+import tempfile
+from itertools import groupby
+
+class DetectorDuplicados:
+    """
+    Detecta claves repetidas (p. ej. NUMERO_GARANTIA + ID_CREDITO) en un archivo.
+
+    En memoria se guarda un diccionario clave -> primera fila de la ventana actual y la
+    lista de repeticiones de esas claves. Cuando entre ambos llegan a
+    max_claves_en_memoria, se vuelcan a disco como una corrida ordenada por (clave, fila)
+    y se vacían. Al finalizar, las corridas se combinan con un merge de k vías que agrupa
+    claves iguales, y los duplicados se ordenan por fila con la misma técnica. La memoria
+    queda acotada por max_claves_en_memoria sin importar cuántas claves o duplicados haya.
+
+    Los registros cuya clave tiene algún componente nulo no se comparan.
+    """
+
+    def __init__(self, columnas, max_claves_en_memoria=1_000_000, directorio_temporal=None):
+        self.columnas = tuple(columnas)
+        self.max_claves_en_memoria = max_claves_en_memoria
+        self.directorio_temporal = directorio_temporal
+        self._claves = {}
+        # Repeticiones de claves de la ventana actual: (clave, fila)
+        self._repeticiones = []
+        self._corridas = []
+        self._temporales = []
+
+    def clave(self, registro):
+        valores = tuple(registro.get(c) for c in self.columnas)
+        if any(v is None or v == '' for v in valores):
+            return None
+        return valores
+
+    def agregar(self, registro, fila):
+        """Registra la clave de una fila; devuelve la primera fila si ya se vio en memoria"""
+        clave = self.clave(registro)
+        if clave is None:
+            return None
+        primera = self._claves.get(clave)
+        if primera is None:
+            self._claves[clave] = fila
+        else:
+            self._repeticiones.append((clave, fila))
+        if len(self._claves) + len(self._repeticiones) >= self.max_claves_en_memoria:
+            self._volcar_corrida()
+        return primera
+
+    @staticmethod
+    def _serializar(clave):
+        # repr distingue 1 de '1' y es estable entre corridas del mismo proceso
+        return '\x1f'.join(repr(v) for v in clave)
+
+    def _ventana(self):
+        """Claves y repeticiones en memoria como pares (clave serializada, fila) ordenados"""
+        pares = [(self._serializar(c), fila) for c, fila in self._claves.items()]
+        pares.extend((self._serializar(c), fila) for c, fila in self._repeticiones)
+        pares.sort()
+        self._claves = {}
+        self._repeticiones = []
+        return pares
+
+    def _volcar_corrida(self):
+        self._corridas.append(self._escribir_temporal(f"{texto}\t{fila}\n" for texto, fila in self._ventana()))
+
+    def _escribir_temporal(self, lineas):
+        fd, ruta = tempfile.mkstemp(prefix='duplicados_', suffix='.run', dir=self.directorio_temporal)
+        self._temporales.append(ruta)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(lineas)
+        return ruta
+
+    @staticmethod
+    def _leer_corrida(ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                texto, fila = linea.rstrip('\n').rsplit('\t', 1)
+                yield texto, int(fila)
+
+    @staticmethod
+    def _leer_duplicados(ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                fila, primera, texto = linea.rstrip('\n').split('\t', 2)
+                yield int(fila), int(primera), texto
+
+    def finalizar(self):
+        """
+        Itera los duplicados (fila, descripcion_clave, primera_fila) ordenados por fila.
+
+        La primera aparición de cada clave (la fila más baja) no se reporta. Los archivos
+        temporales se eliminan al agotar o cerrar el iterador.
+        """
+        try:
+            corridas = [self._leer_corrida(r) for r in self._corridas]
+            corridas.append(iter(self._ventana()))
+            for fila, primera, texto in self._ordenar_por_fila(self._duplicados_por_clave(heapq.merge(*corridas))):
+                yield fila, self._describir(texto), primera
+        finally:
+            self._limpiar()
+
+    @staticmethod
+    def _duplicados_por_clave(ocurrencias):
+        # Las ocurrencias llegan ordenadas por (clave, fila): la primera de cada grupo es la
+        # aparición original y las demás son duplicados, aunque vengan de corridas distintas
+        for texto, grupo in groupby(ocurrencias, key=lambda par: par[0]):
+            _, primera = next(grupo)
+            for _, fila in grupo:
+                yield fila, primera, texto
+
+    def _ordenar_por_fila(self, duplicados):
+        # Ordenación externa: lotes de hasta max_claves_en_memoria ordenados en disco y merge
+        lote = []
+        corridas = []
+        for duplicado in duplicados:
+            lote.append(duplicado)
+            if len(lote) >= self.max_claves_en_memoria:
+                lote.sort()
+                corridas.append(self._escribir_temporal(f"{fila}\t{primera}\t{texto}\n" for fila, primera, texto in lote))
+                lote = []
+        lote.sort()
+        if not corridas:
+            return iter(lote)
+        return heapq.merge(*(self._leer_duplicados(r) for r in corridas), iter(lote))
+
+    def _describir(self, texto):
+        return ', '.join(f"{c}={v}" for c, v in zip(self.columnas, texto.split('\x1f')))
+
+    def _limpiar(self):
+        for ruta in self._temporales:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        self._temporales = []
+        self._corridas = []
+
+    def __del__(self):
+        self._limpiar()
@@ -0,0 +1,150 @@
+import hashlib
+import math
+
+# Clave bajo la que se guarda el perfil en los metadatos de cabecera del AVRO
+CLAVE_METADATOS = "garantias.estadisticas"
+
+_MASCARA_64 = 0xFFFFFFFFFFFFFFFF
+
+def _mezclar(valor):
+    """
+    Hash de 64 bits de un valor, igual en todos los procesos y ejecuciones.
+
+    hash() no sirve: para textos depende de PYTHONHASHSEED (los workers darían
+    estimaciones distintas para los mismos datos) y hash(-1) == hash(-2).
+    """
+    return int.from_bytes(hashlib.blake2b(repr(valor).encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HyperLogLog:
+    """Conteo aproximado de valores distintos con memoria fija (2**p bytes, ~1.6% de error con p=12)"""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registros = bytearray(self.m)
+
+    def agregar(self, valor):
+        x = _mezclar(valor)
+        indice = x >> (64 - self.p)
+        resto = (x << self.p) & _MASCARA_64
+        rango = 64 - self.p + 1 if resto == 0 else 65 - resto.bit_length()
+        if rango > self.registros[indice]:
+            self.registros[indice] = rango
+
+    def combinar(self, otro):
+        """Une otro HyperLogLog del mismo tamaño: el resultado estima la unión de ambos conjuntos"""
+        self.registros = bytearray(map(max, self.registros, otro.registros))
+
+    def estimar(self):
+        alfa = 0.7213 / (1 + 1.079 / self.m)
+        estimacion = alfa * self.m * self.m / sum(2.0 ** -r for r in self.registros)
+        vacios = self.registros.count(0)
+        if estimacion <= 2.5 * self.m and vacios:
+            # Corrección para cardinalidades pequeñas (conteo lineal)
+            estimacion = self.m * math.log(self.m / vacios)
+        return int(round(estimacion))
+
+class EstadisticaColumna:
+    """Estadísticas incrementales de una columna: conteo, nulos, mínimo, máximo y distintos"""
+
+    def __init__(self, tipo, simbolos=None):
+        self.tipo = tipo
+        self.conteo = 0
+        self.nulos = 0
+        self.minimo = None
+        self.maximo = None
+        # Para enums el histograma es exacto y da también los distintos
+        self.histograma = {} if simbolos is not None else None
+        self.distintos = HyperLogLog() if simbolos is None else None
+
+    def actualizar(self, valor):
+        self.conteo += 1
+        if valor is None:
+            self.nulos += 1
+            return
+        if self.histograma is not None:
+            self.histograma[valor] = self.histograma.get(valor, 0) + 1
+            return
+        if self.minimo is None or valor < self.minimo:
+            self.minimo = valor
+        if self.maximo is None or valor > self.maximo:
+            self.maximo = valor
+        self.distintos.agregar(valor)
+
+    def combinar(self, otra):
+        """Acumula las estadísticas de la misma columna calculadas sobre otros registros"""
+        self.conteo += otra.conteo
+        self.nulos += otra.nulos
+        if self.histograma is not None:
+            for valor, conteo in otra.histograma.items():
+                self.histograma[valor] = self.histograma.get(valor, 0) + conteo
+            return
+        if otra.minimo is not None and (self.minimo is None or otra.minimo < self.minimo):
+            self.minimo = otra.minimo
+        if otra.maximo is not None and (self.maximo is None or otra.maximo > self.maximo):
+            self.maximo = otra.maximo
+        self.distintos.combinar(otra.distintos)
+
+    def resultado(self):
+        resultado = {
+            "tipo": self.tipo,
+            "conteo": self.conteo,
+            "nulos": self.nulos,
+            "proporcion_nulos": round(self.nulos / self.conteo, 6) if self.conteo else None,
+        }
+        if self.histograma is not None:
+            resultado["histograma"] = dict(sorted(self.histograma.items()))
+            resultado["distintos"] = len(self.histograma)
+        else:
+            resultado["minimo"] = self.minimo
+            resultado["maximo"] = self.maximo
+            resultado["distintos_aprox"] = self.distintos.estimar()
+        return resultado
+
+def _tipo_base(tipo):
+    """Tipo no nulo de un campo (resuelve uniones ['null', X])"""
+    if isinstance(tipo, list):
+        tipo = next((t for t in tipo if t != 'null'), None)
+    return tipo
+
+class PerfilColumnas:
+    """
+    Perfil por columna de un record AVRO, calculado en una sola pasada.
+
+    Se alimenta con cada registro escrito y su resultado se guarda en la cabecera
+    del AVRO, de modo que los consumidores pueden conocer filas, nulos y rangos sin
+    decodificar bloques de datos. Los perfiles de bloques distintos (las partes de
+    una salida dividida) se combinan en el perfil del total sin volver a recorrerlos.
+    """
+
+    def __init__(self, record_schema, tipos_nombrados=None):
+        tipos_nombrados = tipos_nombrados or {}
+        self.filas = 0
+        self.columnas = {}
+        for field in record_schema['fields']:
+            tipo = _tipo_base(field['type'])
+            # Referencias por nombre a tipos definidos en otro punto del esquema
+            if isinstance(tipo, str) and tipo in tipos_nombrados:
+                tipo = tipos_nombrados[tipo]
+            if isinstance(tipo, dict) and tipo.get('type') == 'enum':
+                self.columnas[field['name']] = EstadisticaColumna('enum', tipo.get('symbols', []))
+            else:
+                nombre_tipo = tipo.get('type') if isinstance(tipo, dict) else tipo
+                self.columnas[field['name']] = EstadisticaColumna(nombre_tipo)
+
+    def actualizar(self, registro):
+        self.filas += 1
+        for nombre, estadistica in self.columnas.items():
+            estadistica.actualizar(registro.get(nombre))
+
+    def combinar(self, otro):
+        """Acumula el perfil de otro bloque de registros del mismo esquema (p. ej. una parte)"""
+        self.filas += otro.filas
+        for nombre, estadistica in self.columnas.items():
+            estadistica.combinar(otro.columnas[nombre])
+
+    def resultado(self):
+        return {
+            "filas": self.filas,
+            "columnas": {nombre: e.resultado() for nombre, e in self.columnas.items()},
+        }
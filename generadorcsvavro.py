@@ -1,24 +1,111 @@
 import pandas as pd
+import numpy as np
 import json
+import math
 from fastavro import writer, parse_schema
+from fastavro.write import Writer
 from pathlib import Path
 from io import BytesIO
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import defaultdict
+from estadisticas import PerfilColumnas, CLAVE_METADATOS
+from duplicados import DetectorDuplicados
+from catalogos import registro_catalogos
+from reglas import cargar_reglas, NOMBRE_ARCHIVO_REGLAS, RUTA_REGLAS_PROYECTO
+from perfilador import PerfiladorMuestreo
+
+# Cache de esquemas parseados por proceso. La clave incluye mtime y tamaño para
+# que un esquema modificado en disco se vuelva a cargar sin reiniciar.
+_CACHE_SCHEMAS = {}
+_CACHE_SCHEMAS_LOCK = threading.Lock()
+_CACHE_SCHEMAS_MAX = 32
+
+def cargar_schema(ruta_schema):
+    """Carga y parsea un esquema AVRO reutilizando el resultado entre solicitudes"""
+    ruta = Path(ruta_schema).resolve()
+    stat = ruta.stat()
+    clave = (str(ruta), stat.st_mtime_ns, stat.st_size)
+    with _CACHE_SCHEMAS_LOCK:
+        schema = _CACHE_SCHEMAS.get(clave)
+    if schema is None:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            schema = parse_schema(json.load(f))
+        with _CACHE_SCHEMAS_LOCK:
+            # Descartar versiones anteriores del mismo archivo
+            for anterior in [k for k in _CACHE_SCHEMAS if k[0] == clave[0]]:
+                del _CACHE_SCHEMAS[anterior]
+            # Los esquemas subidos en /convert viven en directorios temporales
+            # distintos; limitar el tamaño evita que la cache crezca sin fin
+            while len(_CACHE_SCHEMAS) >= _CACHE_SCHEMAS_MAX:
+                del _CACHE_SCHEMAS[next(iter(_CACHE_SCHEMAS))]
+            _CACHE_SCHEMAS[clave] = schema
+    return schema
+
+# Columnas que identifican una garantía dentro del archivo de una entidad
+COLUMNAS_CLAVE = ('NUMERO_GARANTIA', 'ID_CREDITO')
+
+# Columnas de texto con pocos valores distintos que se leen como categóricas, además
+# de las columnas enum del esquema (cuyos valores se derivan de sus símbolos)
+COLUMNAS_CATEGORICAS = ('NOMBRE_INTERMEDIARIO', 'CODIGO_PRODUCTO_GARANTIA')
+
+# Textos del CSV que se aceptan en columnas boolean
+VALORES_BOOLEANOS = {'true': True, '1': True, 'false': False, '0': False}
 
 class GeneradorCsvAvro:
-    def __init__(self, tipo_entidad, codigo_entidad, nombre_entidad, fecha_corte, ruta_schema, ruta_csv):
+    def __init__(self, tipo_entidad, codigo_entidad, nombre_entidad, fecha_corte, ruta_schema, ruta_csv,
+                 columnas_clave=COLUMNAS_CLAVE, max_claves_en_memoria=1_000_000, catalogos=None,
+                 ruta_reglas=None, max_registros_por_parte=None, max_bytes_por_parte=None,
+                 tamano_lote=50_000, columnas_categoricas=COLUMNAS_CATEGORICAS):
         self.tipo_entidad = tipo_entidad
         self.codigo_entidad = codigo_entidad
         self.nombre_entidad = nombre_entidad
         self.fecha_corte = fecha_corte
         self.ruta_schema = Path(ruta_schema)
         self.ruta_csv = Path(ruta_csv)
+        # Unicidad: columnas_clave vacío o None desactiva la verificación
+        self.columnas_clave = tuple(columnas_clave or ())
+        self.max_claves_en_memoria = max_claves_en_memoria
+        # Catálogos de referencia (campo -> CatalogoReferencia); por defecto los del proceso
+        self.catalogos = registro_catalogos.catalogos() if catalogos is None else catalogos
+        # Reglas declarativas: Reglas_AVRO.json junto al esquema o, si no existe, el
+        # archivo de reglas del proyecto (RUTA_REGLAS)
+        if ruta_reglas is None:
+            candidatas = (self.ruta_schema.parent / NOMBRE_ARCHIVO_REGLAS, RUTA_REGLAS_PROYECTO)
+            ruta_reglas = next((r for r in candidatas if r.is_file()), None)
+        self.reglas = cargar_reglas(ruta_reglas) if ruta_reglas else None
+        # Salida dividida en partes: con alguno de los umbrales se generan archivos
+        # <nombre>.<ejecución>.part-00000.avro y un manifiesto <nombre>.manifest.json
+        for nombre, umbral in (('max_registros_por_parte', max_registros_por_parte),
+                               ('max_bytes_por_parte', max_bytes_por_parte)):
+            if umbral is not None and umbral < 1:
+                raise ValueError(f"{nombre} debe ser mayor o igual a 1")
+        self.max_registros_por_parte = max_registros_por_parte
+        self.max_bytes_por_parte = max_bytes_por_parte
+        self.partes = []
+        self.ruta_manifiesto = None
+        # Filas del CSV que se leen, convierten y validan por bloque
+        self.tamano_lote = tamano_lote
+        self.total_inconsistencias = 0
         self.schema = self._cargar_schema()
+        # Columnas enum del detalle: campo -> (nombre del enum, símbolos)
+        self.enums_detalle = self._obtener_enums_detalle()
+        # Columnas numéricas del detalle: campo -> 'int' o 'float'
+        self.numericos_detalle = self._obtener_numericos_detalle()
+        # Enums y columnas de baja cardinalidad se leen como categóricas: cada valor
+        # distinto es un único objeto y la validación de enums se hace sobre sus códigos
+        self.columnas_categoricas = set(self.enums_detalle) | set(columnas_categoricas or ())
         self.garantias = []
         self.inconsistencias = []
+        self.estadisticas = None
+        # Inconsistencias detectadas por validaciones vectorizadas, por posición de fila
+        self.errores_por_fila = {}
 
     def _cargar_schema(self):
-        with open(self.ruta_schema, 'r', encoding='utf-8') as f:
-            return parse_schema(json.load(f))
+        return cargar_schema(self.ruta_schema)
 
     def validar_campos_principales(self):
         errores = []
@@ -32,13 +119,132 @@ class GeneradorCsvAvro:
             errores.append("fecha_corte debe ser int")
         return errores
 
+    def _obtener_enums_detalle(self):
+        detalle_schema = self._obtener_detalle_schema()
+        if detalle_schema is None:
+            return {}
+        tipos_nombrados = self.schema.get('__named_schemas', {})
+        enums = {}
+        for field in detalle_schema['fields']:
+            tipo = field['type']
+            if isinstance(tipo, list):
+                tipo = next((t for t in tipo if t != 'null'), None)
+            if isinstance(tipo, str):
+                tipo = tipos_nombrados.get(tipo, tipo)
+            if isinstance(tipo, dict) and tipo.get('type') == 'enum':
+                enums[field['name']] = (tipo.get('name'), tipo.get('symbols', []))
+        return enums
+
+    def _obtener_numericos_detalle(self):
+        detalle_schema = self._obtener_detalle_schema()
+        if detalle_schema is None:
+            return {}
+        numericos = {}
+        for field in detalle_schema['fields']:
+            tipo = field['type']
+            if isinstance(tipo, list):
+                tipo = next((t for t in tipo if t != 'null'), None)
+            # Primitivos con logicalType (p. ej. {'type': 'int', 'logicalType': 'date'})
+            if isinstance(tipo, dict):
+                tipo = tipo.get('type')
+            if tipo in ('int', 'long'):
+                numericos[field['name']] = 'int'
+            elif tipo in ('float', 'double'):
+                numericos[field['name']] = 'float'
+        return numericos
+
+    def _dtypes_csv(self):
+        # Columnas categóricas como 'category'; el resto como texto
+        return defaultdict(lambda: str, {columna: 'category' for columna in self.columnas_categoricas})
+
     def cargar_garantias(self):
-        df = pd.read_csv(self.ruta_csv, sep=';', dtype=str).fillna('')
+        df = pd.read_csv(self.ruta_csv, sep=';', dtype=self._dtypes_csv())
+        self.garantias = self._preparar_lote(df, 0)
+
+    def _iterar_lotes(self):
+        # Lectura por bloques: la memoria de lectura y conversión no depende del tamaño del archivo
+        desplazamiento = 0
+        for df in pd.read_csv(self.ruta_csv, sep=';', dtype=self._dtypes_csv(), chunksize=self.tamano_lote):
+            yield desplazamiento, self._preparar_lote(df, desplazamiento)
+            desplazamiento += len(df)
+
+    def _preparar_lote(self, df, desplazamiento):
+        for columna in df.columns:
+            if isinstance(df[columna].dtype, pd.CategoricalDtype) and '' not in df[columna].cat.categories:
+                df[columna] = df[columna].cat.add_categories('')
+        df = df.fillna('')
         df['FECHA_CORTE'] = self.fecha_corte
-        self.garantias = df.to_dict(orient='records')
+        self.validar_enums(df, desplazamiento)
+        self.validar_numericos(df, desplazamiento)
+        self.validar_catalogos(df, desplazamiento)
+        self.validar_reglas(df, desplazamiento)
+        return df.to_dict(orient='records')
 
-    def ajustar_garantias_a_schema(self):
-        campos_schema = {field['name'] for field in self.schema['fields']}
+    def _agregar_error_fila(self, posicion, error):
+        self.errores_por_fila.setdefault(int(posicion), []).append(error)
+
+    def validar_enums(self, df, desplazamiento=0):
+        # Se valida cada categoría una vez y se propaga a las filas por su código
+        for campo, (nombre_enum, simbolos) in self.enums_detalle.items():
+            if campo not in df.columns or not isinstance(df[campo].dtype, pd.CategoricalDtype):
+                continue
+            categorias = df[campo].cat.categories
+            invalidas = ~categorias.isin(simbolos) & np.asarray(categorias != '')
+            if not invalidas.any():
+                continue
+            codigos = df[campo].cat.codes.to_numpy()
+            for posicion in np.flatnonzero((codigos >= 0) & invalidas[codigos]):
+                fila = desplazamiento + posicion
+                self._agregar_error_fila(fila, f"Fila {fila+1}: Campo 'Detalle_Garantias[0].{campo}' valor '{categorias[codigos[posicion]]}' no es válido para enum {nombre_enum}")
+
+    def validar_numericos(self, df, desplazamiento=0):
+        # Una celda con valor que no se puede convertir a int/float quedaría como null
+        # en el AVRO, e inf/nan no son números válidos en el JSON del perfil de columnas.
+        # Un filtro por columna (patrón entero o pd.to_numeric) deja pocas candidatas,
+        # que se confirman con la misma conversión que aplica el generador.
+        for campo, tipo in self.numericos_detalle.items():
+            if campo not in df.columns or pd.api.types.is_numeric_dtype(df[campo].dtype):
+                continue
+            valores = df[campo].astype(str) if isinstance(df[campo].dtype, pd.CategoricalDtype) else df[campo]
+            presentes = (valores != '').to_numpy()
+            if tipo == 'int':
+                candidatas = presentes & ~valores.str.fullmatch(r'[+-]?\d+').to_numpy(dtype=bool)
+                convertir = int
+            else:
+                candidatas = presentes & ~np.isfinite(pd.to_numeric(valores, errors='coerce').to_numpy(dtype='float64'))
+                convertir = float
+            for posicion in np.flatnonzero(candidatas):
+                valor = valores.iat[posicion]
+                try:
+                    if math.isfinite(convertir(valor)):
+                        continue
+                except (TypeError, ValueError):
+                    pass
+                fila = desplazamiento + posicion
+                self._agregar_error_fila(fila, f"Fila {fila+1}: Campo 'Detalle_Garantias[0].{campo}' con valor inválido '{valor}'")
+
+    def validar_catalogos(self, df, desplazamiento=0):
+        # Una prueba de pertenencia por columna en lugar de una búsqueda por celda
+        for campo, catalogo in self.catalogos.items():
+            if campo not in df.columns:
+                continue
+            valores = df[campo]
+            invalidos = (valores != '').to_numpy() & ~catalogo.contiene(valores)
+            for posicion in np.flatnonzero(invalidos):
+                fila = desplazamiento + posicion
+                self._agregar_error_fila(fila, f"Fila {fila+1}: Campo 'Detalle_Garantias[0].{campo}' valor '{valores.iat[posicion]}' no existe en el catálogo {campo}")
+
+    def validar_reglas(self, df, desplazamiento=0):
+        # Cada regla es un predicado sobre columnas completas del bloque
+        if self.reglas is None:
+            return
+        for regla, posiciones in self.reglas.evaluar(df):
+            valores = df[regla.campo]
+            for posicion in posiciones:
+                fila = desplazamiento + posicion
+                self._agregar_error_fila(fila, f"Fila {fila+1}: Campo 'Detalle_Garantias[0].{regla.campo}' valor '{valores.iat[posicion]}' no cumple la regla {regla.descripcion}")
+
+    def _obtener_detalle_schema(self):
         # Obtener el sub-esquema de Detalle_Garantias
         detalle_schema = None
         for field in self.schema['fields']:
@@ -48,8 +254,13 @@ class GeneradorCsvAvro:
                     detalle_type = next((t for t in detalle_type if isinstance(t, dict) and t.get('type') == 'array'), None)
                 if detalle_type and isinstance(detalle_type, dict) and detalle_type.get('type') == 'array':
                     detalle_schema = detalle_type['items']
-        # Mapeo explícito de campos del CSV a los del esquema Avro
-        mapeo = {f['name']: f['name'] for f in detalle_schema['fields']}
+        return detalle_schema
+
+    def ajustar_garantias_a_schema(self):
+        campos_schema = {field['name'] for field in self.schema['fields']}
+        detalle_schema = self._obtener_detalle_schema()
+        # Mapeo explícito de campos del CSV a los del esquema Avro, con el tipo esperado
+        mapeo = [(f['name'], f['name'], f['type']) for f in detalle_schema['fields']]
         tipo_entidad_valor = self.tipo_entidad
         codigo_entidad_valor = self.codigo_entidad
         nombre_entidad_valor = self.nombre_entidad
@@ -62,9 +273,7 @@ class GeneradorCsvAvro:
             registro['nombre_entidad'] = str(nombre_entidad_valor)
             registro['fecha_corte'] = int(fecha_corte_valor)
             detalle = {}
-            for csv_key, avro_key in mapeo.items():
-                # Buscar el tipo esperado en el sub-esquema
-                tipo_campo = next((f['type'] for f in detalle_schema['fields'] if f['name'] == avro_key), None)
+            for csv_key, avro_key, tipo_campo in mapeo:
                 detalle[avro_key] = self._convertir_tipo_tipo(tipo_campo, garantia.get(csv_key))
             registro['Detalle_Garantias'] = [self._limpiar_garantia(detalle)]
             for campo in campos_schema:
@@ -79,20 +288,28 @@ class GeneradorCsvAvro:
         # Si es enum, dejar como string
         if isinstance(tipo, dict) and tipo.get('type') == 'enum':
             return valor if valor != '' else None
-        # Si es int
-        if tipo == 'int' or (isinstance(tipo, dict) and tipo.get('type') == 'int'):
+        # Primitivos con logicalType (p. ej. {'type': 'int', 'logicalType': 'date'})
+        if isinstance(tipo, dict) and tipo.get('type') not in ('record', 'array', 'map', 'fixed'):
+            tipo = tipo.get('type')
+        # Si es int o long
+        if tipo in ('int', 'long'):
             try:
                 return int(valor) if valor not in (None, '') else None
             except:
                 return None
-        # Si es float
-        if tipo == 'float' or (isinstance(tipo, dict) and tipo.get('type') == 'float'):
+        # Si es float o double
+        if tipo in ('float', 'double'):
             try:
                 return float(valor) if valor not in (None, '') else None
             except:
                 return None
+        # Si es boolean: un texto no reconocido se conserva para que la validación de tipo lo reporte
+        if tipo == 'boolean':
+            if valor in (None, ''):
+                return None
+            return VALORES_BOOLEANOS.get(str(valor).strip().lower(), valor)
         # Si es string
-        if tipo == 'string' or (isinstance(tipo, dict) and tipo.get('type') == 'string'):
+        if tipo == 'string':
             return str(valor) if valor not in (None, '') else None
         # Otros casos
         return valor if valor != '' else None
@@ -178,15 +395,122 @@ class GeneradorCsvAvro:
     def _validar_tipo(self, valor, tipo):
         if isinstance(tipo, list):  # union
             return any(self._validar_tipo(valor, t) for t in tipo if t != 'null')
+        if isinstance(tipo, dict):
+            tipo_base = tipo.get('type')
+            if tipo_base == 'enum':
+                return isinstance(valor, str) or valor is None
+            # Primitivos con logicalType (p. ej. {'type': 'int', 'logicalType': 'date'})
+            if isinstance(tipo_base, str) and tipo_base not in ('record', 'array', 'map', 'fixed'):
+                return self._validar_tipo(valor, tipo_base)
+            return True  # records y arrays se validan campo a campo
+        if valor is None:
+            return True
         if tipo == 'string':
-            return isinstance(valor, str) or valor is None
-        if tipo == 'int':
-            return isinstance(valor, int) or valor is None
-        return True  # otros tipos pueden extenderse
+            return isinstance(valor, str)
+        if tipo in ('int', 'long'):
+            return isinstance(valor, int) and not isinstance(valor, bool)
+        if tipo in ('float', 'double'):
+            return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+        if tipo == 'boolean':
+            return isinstance(valor, bool)
+        if tipo == 'bytes':
+            return isinstance(valor, bytes)
+        return True  # tipos nombrados (referencias a enums o records)
 
     def generar_avro(self, ruta_salida):
+        # El perfil de columnas viaja en la cabecera: se lee sin decodificar bloques.
+        # Se calcula aquí, en una sola pasada por los registros que se escriben
+        if self.max_registros_por_parte or self.max_bytes_por_parte:
+            return self._generar_avro_por_partes(Path(ruta_salida))
+        self.estadisticas = self._perfilar(self.garantias).resultado()
         with open(ruta_salida, 'wb') as out:
-            writer(out, self.schema, self.garantias)
+            self._escribir_fastavro(out, self.garantias, {CLAVE_METADATOS: json.dumps(self.estadisticas, allow_nan=False)})
+
+    def _generar_avro_por_partes(self, ruta_salida):
+        """
+        Escribe los registros en varios contenedores AVRO independientes.
+
+        Una parte se cierra al alcanzar max_registros_por_parte registros o cuando el
+        archivo supera max_bytes_por_parte (medido al cerrar cada bloque, así que una
+        parte puede exceder el umbral en menos de un bloque más su cabecera). Cada parte
+        lleva en su cabecera el perfil de sus propios registros; el manifiesto lista las
+        partes con sus registros, tamaño y perfil, además del perfil global, que se
+        obtiene combinando los de las partes.
+
+        Los registros se codifican una sola vez: los bloques de la parte se escriben en
+        un temporal con una marca de sincronización fijada de antemano y, ya conocido el
+        perfil, se copian detrás de la cabecera definitiva, que usa la misma marca.
+
+        Los nombres de las partes llevan un identificador de la ejecución: dos
+        conversiones de la misma entidad y corte nunca escriben la misma parte, y el
+        manifiesto referencia solo las de su propia ejecución.
+        """
+        self.partes = []
+        total = self._perfilar(())
+        ejecucion = uuid.uuid4().hex[:12]
+        inicio = 0
+        while inicio < len(self.garantias):
+            ruta_parte = ruta_salida.with_name(f"{ruta_salida.stem}.{ejecucion}.part-{len(self.partes):05d}.avro")
+            marca = os.urandom(16)
+            with tempfile.TemporaryFile(dir=ruta_salida.parent) as bloques:
+                inicio_bloques, fin = self._escribir_bloques_fastavro(bloques, marca, inicio)
+                perfil = self._perfilar(self.garantias[inicio:fin])
+                total.combinar(perfil)
+                estadisticas = perfil.resultado()
+                with open(ruta_parte, 'wb') as out:
+                    # Solo cabecera: no se escriben registros con este escritor
+                    Writer(out, self.schema, metadata={CLAVE_METADATOS: json.dumps(estadisticas, allow_nan=False)}, sync_marker=marca)
+                    bloques.seek(inicio_bloques)
+                    shutil.copyfileobj(bloques, out)
+            self.partes.append({
+                'archivo': ruta_parte.name,
+                'registros': fin - inicio,
+                'bytes': ruta_parte.stat().st_size,
+                'estadisticas': estadisticas,
+            })
+            inicio = fin
+        self.estadisticas = total.resultado()
+        self.ruta_manifiesto = ruta_salida.with_name(f"{ruta_salida.stem}.manifest.json")
+        manifiesto = {
+            'formato': 'avro',
+            'ejecucion': ejecucion,
+            'total_registros': sum(p['registros'] for p in self.partes),
+            'total_partes': len(self.partes),
+            'partes': self.partes,
+            'estadisticas': self.estadisticas,
+        }
+        with open(self.ruta_manifiesto, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, ensure_ascii=False, indent=2, allow_nan=False)
+
+    def _escribir_bloques_fastavro(self, destino, marca, inicio):
+        # Como _escribir_fastavro, aísla en los perfiles el tiempo de codificación de
+        # fastavro. Codifica la parte que empieza en inicio tras una cabecera provisional
+        # y devuelve la posición de destino donde empiezan los bloques y la del registro
+        # donde termina la parte
+        escritor = Writer(destino, self.schema, sync_marker=marca)
+        inicio_bloques = destino.tell()
+        fin = inicio
+        while fin < len(self.garantias):
+            escritor.write(self.garantias[fin])
+            fin += 1
+            if self.max_registros_por_parte and fin - inicio >= self.max_registros_por_parte:
+                break
+            if self.max_bytes_por_parte and destino.tell() >= self.max_bytes_por_parte:
+                break
+        escritor.flush()
+        return inicio_bloques, fin
+
+    def _perfilar(self, registros):
+        perfil = PerfilColumnas(self._obtener_detalle_schema(), self.schema.get('__named_schemas'))
+        for garantia in registros:
+            for item in garantia.get('Detalle_Garantias') or []:
+                perfil.actualizar(item)
+        return perfil
+
+    def _escribir_fastavro(self, out, registros, metadata):
+        # fastavro.writer es código nativo y no crea frames de Python: este método
+        # aísla su tiempo como un nodo propio en los perfiles por muestreo
+        writer(out, self.schema, registros, metadata=metadata)
 
     def guardar_inconsistencias(self, ruta_log):
         if self.inconsistencias:
@@ -194,76 +518,165 @@ class GeneradorCsvAvro:
                 for error in self.inconsistencias:
                     f.write(error + '\n')
 
-    def ejecutar(self, ruta_salida_avro, ruta_log):
+    def ejecutar(self, ruta_salida_avro, ruta_log, ruta_perfil=None, notificar=None):
+        # Con ruta_perfil se guarda un perfil por muestreo (pilas colapsadas) de la ejecución.
+        # notificar(evento) recibe el progreso y los lotes de inconsistencias a medida que se detectan
+        if ruta_perfil is None:
+            return self._ejecutar(ruta_salida_avro, ruta_log, notificar)
+        perfilador = PerfiladorMuestreo()
+        with perfilador:
+            self._ejecutar(ruta_salida_avro, ruta_log, notificar)
+        perfilador.guardar(ruta_perfil)
+
+    def _validar_registro(self, idx, garantia):
+        self.inconsistencias = list(self.errores_por_fila.pop(idx, ()))
+        # Validar campos principales
+        for field in self.schema['fields']:
+            nombre = field['name']
+            tipo = field['type']
+            valor = garantia.get(nombre)
+            # Validar Detalle_Garantias como array de record
+            if nombre == 'Detalle_Garantias' and isinstance(valor, list):
+                # Obtener el sub-esquema
+                detalle_schema = None
+                if isinstance(tipo, list):
+                    tipo = next((t for t in tipo if isinstance(t, dict) and t.get('type') == 'array'), None)
+                if tipo and isinstance(tipo, dict) and tipo.get('type') == 'array':
+                    detalle_schema = tipo['items']
+                for i, item in enumerate(valor):
+                    for subfield in detalle_schema['fields']:
+                        subnombre = subfield['name']
+                        subtipo = subfield['type']
+                        subvalor = item.get(subnombre)
+                        # Validación especial para enums (las columnas categóricas ya se
+                        # validaron por lote en validar_enums)
+                        if subnombre in self.columnas_categoricas and subnombre in self.enums_detalle:
+                            pass
+                        elif isinstance(subtipo, list):
+                            tipos_enum = [t for t in subtipo if isinstance(t, dict) and t.get('type') == 'enum']
+                            for t_enum in tipos_enum:
+                                if subvalor is not None and subvalor != '' and subvalor not in t_enum.get('symbols', []):
+                                    self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' valor '{subvalor}' no es válido para enum {t_enum.get('name')}")
+                        elif isinstance(subtipo, dict) and subtipo.get('type') == 'enum':
+                            if subvalor is not None and subvalor != '' and subvalor not in subtipo.get('symbols', []):
+                                self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' valor '{subvalor}' no es válido para enum {subtipo.get('name')}")
+                        # Validación estándar
+                        if not self._validar_tipo(subvalor, subtipo):
+                            self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' con valor inválido '{subvalor}'")
+            else:
+                # Validación especial para enums
+                if isinstance(tipo, list):
+                    tipos_enum = [t for t in tipo if isinstance(t, dict) and t.get('type') == 'enum']
+                    for t_enum in tipos_enum:
+                        if valor is not None and valor != '' and valor not in t_enum.get('symbols', []):
+                            self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' valor '{valor}' no es válido para enum {t_enum.get('name')}")
+                elif isinstance(tipo, dict) and tipo.get('type') == 'enum':
+                    if valor is not None and valor != '' and valor not in tipo.get('symbols', []):
+                        self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' valor '{valor}' no es válido para enum {tipo.get('name')}")
+                # Validación estándar
+                if not self._validar_tipo(valor, tipo):
+                    self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' con valor inválido '{valor}'")
+        return self.inconsistencias
+
+    def _ejecutar(self, ruta_salida_avro, ruta_log, notificar=None):
         errores = self.validar_campos_principales()
         if errores:
             raise ValueError(f"Errores en campos principales: {errores}")
-        self.cargar_garantias()
-        self.ajustar_garantias_a_schema()
-        # Validar y filtrar registros válidos
+        # Validar y filtrar registros válidos. Lectura, conversión y validación son por
+        # lotes, pero los válidos se conservan hasta el final: los duplicados se descartan
+        # con el archivo completo y la cabecera del AVRO lleva el perfil de todos ellos
         registros_validos = []
-        registros_invalidos = []
-        for idx, garantia in enumerate(self.garantias):
-            self.inconsistencias = []
-            # Validar campos principales
-            for field in self.schema['fields']:
-                nombre = field['name']
-                tipo = field['type']
-                valor = garantia.get(nombre)
-                # Validar Detalle_Garantias como array de record
-                if nombre == 'Detalle_Garantias' and isinstance(valor, list):
-                    # Obtener el sub-esquema
-                    detalle_schema = None
-                    if isinstance(tipo, list):
-                        tipo = next((t for t in tipo if isinstance(t, dict) and t.get('type') == 'array'), None)
-                    if tipo and isinstance(tipo, dict) and tipo.get('type') == 'array':
-                        detalle_schema = tipo['items']
-                    for i, item in enumerate(valor):
-                        for subfield in detalle_schema['fields']:
-                            subnombre = subfield['name']
-                            subtipo = subfield['type']
-                            subvalor = item.get(subnombre)
-                            # Validación especial para enums
-                            if isinstance(subtipo, list):
-                                tipos_enum = [t for t in subtipo if isinstance(t, dict) and t.get('type') == 'enum']
-                                for t_enum in tipos_enum:
-                                    if subvalor is not None and subvalor != '' and subvalor not in t_enum.get('symbols', []):
-                                        self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' valor '{subvalor}' no es válido para enum {t_enum.get('name')}")
-                            elif isinstance(subtipo, dict) and subtipo.get('type') == 'enum':
-                                if subvalor is not None and subvalor != '' and subvalor not in subtipo.get('symbols', []):
-                                    self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' valor '{subvalor}' no es válido para enum {subtipo.get('name')}")
-                            # Validación estándar
-                            if not self._validar_tipo(subvalor, subtipo):
-                                self.inconsistencias.append(f"Fila {idx+1}: Campo 'Detalle_Garantias[{i}].{subnombre}' con valor inválido '{subvalor}'")
-                else:
-                    # Validación especial para enums
-                    if isinstance(tipo, list):
-                        tipos_enum = [t for t in tipo if isinstance(t, dict) and t.get('type') == 'enum']
-                        for t_enum in tipos_enum:
-                            if valor is not None and valor != '' and valor not in t_enum.get('symbols', []):
-                                self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' valor '{valor}' no es válido para enum {t_enum.get('name')}")
-                    elif isinstance(tipo, dict) and tipo.get('type') == 'enum':
-                        if valor is not None and valor != '' and valor not in tipo.get('symbols', []):
-                            self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' valor '{valor}' no es válido para enum {tipo.get('name')}")
-                    # Validación estándar
-                    if not self._validar_tipo(valor, tipo):
-                        self.inconsistencias.append(f"Fila {idx+1}: Campo '{nombre}' con valor inválido '{valor}'")
-            if self.inconsistencias:
-                registros_invalidos.append((garantia, list(self.inconsistencias)))
-            else:
-                registros_validos.append(garantia)
-        print(f"Registros válidos: {len(registros_validos)}")
-        print(f"Registros inválidos: {len(registros_invalidos)}")
-        for reg, incs in registros_invalidos:
-            for inc in incs:
+        filas_validas = []
+        total_invalidos = 0
+        filas_leidas = 0
+        filas_convertidas = 0
+        # Unicidad de la clave entre los registros que pasan la validación de tipos
+        detector = DetectorDuplicados(self.columnas_clave, self.max_claves_en_memoria) if self.columnas_clave else None
+        # Las inconsistencias se escriben en el log y se notifican a medida que aparecen,
+        # sin acumularlas en memoria
+        self.total_inconsistencias = 0
+        log = None
+
+        def reportar(inconsistencias):
+            nonlocal log
+            if not inconsistencias:
+                return
+            if log is None:
+                log = open(ruta_log, 'w', encoding='utf-8')
+            for inc in inconsistencias:
                 print(inc)
-        # Guardar inconsistencias en el log
-        if registros_invalidos:
-            with open(ruta_log, 'w', encoding='utf-8') as f:
-                for reg, incs in registros_invalidos:
-                    for inc in incs:
-                        f.write(inc + '\n')
+                log.write(inc + '\n')
+            self.total_inconsistencias += len(inconsistencias)
+            if notificar:
+                notificar({'evento': 'inconsistencias', 'inconsistencias': inconsistencias})
+
+        def progreso(fase):
+            if notificar:
+                notificar({
+                    'evento': 'progreso',
+                    'fase': fase,
+                    'filas_leidas': filas_leidas,
+                    'filas_convertidas': filas_convertidas,
+                    'validas': len(registros_validos),
+                    'invalidas': total_invalidos,
+                })
+
+        try:
+            for desplazamiento, lote in self._iterar_lotes():
+                filas_leidas += len(lote)
+                self.garantias = lote
+                self.ajustar_garantias_a_schema()
+                filas_convertidas += len(self.garantias)
+                progreso('conversion')
+                inconsistencias_lote = []
+                for posicion, garantia in enumerate(self.garantias):
+                    idx = desplazamiento + posicion
+                    inconsistencias = self._validar_registro(idx, garantia)
+                    if inconsistencias:
+                        total_invalidos += 1
+                        inconsistencias_lote.extend(inconsistencias)
+                    else:
+                        registros_validos.append(garantia)
+                        filas_validas.append(idx+1)
+                        if detector:
+                            for item in garantia.get('Detalle_Garantias') or []:
+                                detector.agregar(item, idx+1)
+                reportar(inconsistencias_lote)
+                progreso('validacion')
+            if detector:
+                # Los duplicados llegan ordenados por fila: se descartan recorriendo los
+                # válidos en el mismo orden y se reportan por lotes, sin acumularlos
+                duplicados = detector.finalizar()
+                siguiente = next(duplicados, None)
+                conservados = []
+                mensajes = []
+                for fila, garantia in zip(filas_validas, registros_validos):
+                    duplicada = False
+                    while siguiente is not None and siguiente[0] == fila:
+                        _, clave, primera = siguiente
+                        mensajes.append(f"Fila {fila}: Clave duplicada ({clave}), primera aparición en la fila {primera}")
+                        duplicada = True
+                        siguiente = next(duplicados, None)
+                    if not duplicada:
+                        conservados.append(garantia)
+                        continue
+                    total_invalidos += 1
+                    if len(mensajes) >= self.tamano_lote:
+                        reportar(mensajes)
+                        mensajes = []
+                reportar(mensajes)
+                registros_validos = conservados
+        finally:
+            if log is not None:
+                log.close()
+        print(f"Registros válidos: {len(registros_validos)}")
+        print(f"Registros inválidos: {total_invalidos}")
         # Solo escribir los registros válidos en el Avro
+        self.garantias = registros_validos
+        progreso('escritura')
+        # El perfil de columnas se calcula al escribir, una vez por registro
         if registros_validos:
-            self.garantias = registros_validos
             self.generar_avro(ruta_salida_avro)
+        else:
+            self.estadisticas = self._perfilar(()).resultado()
+        progreso('completado')
@@ -0,0 +1,67 @@
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+class PerfiladorMuestreo:
+    """
+    Perfilador por muestreo del hilo que lo activa.
+
+    Un hilo auxiliar toma la pila de Python del hilo perfilado cada `intervalo`
+    segundos y acumula pilas idénticas. El resultado se guarda en formato de pilas
+    colapsadas ("a;b;c conteo"), que speedscope (https://www.speedscope.app) y
+    flamegraph.pl abren directamente como flame graph.
+    """
+
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self.muestras = Counter()
+        self.duracion = None
+        self._hilo_objetivo = None
+        self._hilo_muestreo = None
+        self._detener = threading.Event()
+        self._inicio = None
+
+    @staticmethod
+    def _etiqueta(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+    def _pila(self, frame):
+        pila = []
+        while frame is not None:
+            pila.append(self._etiqueta(frame))
+            frame = frame.f_back
+        pila.reverse()
+        return tuple(pila)
+
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo):
+            frame = sys._current_frames().get(self._hilo_objetivo)
+            if frame is not None:
+                self.muestras[self._pila(frame)] += 1
+
+    def __enter__(self):
+        self._hilo_objetivo = threading.get_ident()
+        self._detener.clear()
+        self._inicio = time.perf_counter()
+        self._hilo_muestreo = threading.Thread(target=self._muestrear, name="perfilador-muestreo", daemon=True)
+        self._hilo_muestreo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        self._hilo_muestreo.join()
+        self.duracion = time.perf_counter() - self._inicio
+        return False
+
+    def colapsado(self):
+        """Líneas en formato de pilas colapsadas, de la pila más frecuente a la menos"""
+        return [f"{';'.join(pila)} {conteo}" for pila, conteo in self.muestras.most_common()]
+
+    def guardar(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as f:
+            for linea in self.colapsado():
+                f.write(linea + '\n')
+        return ruta
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+Prueba de carga concurrente del API CSV to AVRO
+
+Inicia api.py localmente (o usa --url de un servidor ya iniciado), envía cargas
+concurrentes a /convert y /convert-with-default-schema con CSV de distintos
+tamaños mientras sondea /health, y reporta latencias p50/p95/p99, throughput,
+tasa de errores y memoria RSS del servidor.
+
+Ejemplos:
+    python prueba_carga.py --concurrencia 8 --solicitudes 64 --filas 100,10000
+    python prueba_carga.py --url http://localhost:8000 --endpoint default
+    python prueba_carga.py --workers 4 --json resultado_carga.json
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+CSV_EJEMPLO = Path("Data/ArchivoCSV.csv")
+SCHEMA = Path("Esquema_AVRO.json")
+ENDPOINTS = {
+    "convert": "/convert",
+    "default": "/convert-with-default-schema",
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de carga del API CSV to AVRO")
+    parser.add_argument("--url", help="URL de un servidor ya iniciado; si se omite se inicia api.py")
+    parser.add_argument("--puerto", type=int, default=8765, help="Puerto del servidor local")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn del servidor local")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Solicitudes simultáneas")
+    parser.add_argument("--solicitudes", type=int, default=32, help="Solicitudes por tamaño de archivo")
+    parser.add_argument("--filas", default="100,5000", help="Filas por CSV, separadas por coma")
+    parser.add_argument("--endpoint", choices=["convert", "default", "ambos"], default="ambos")
+    parser.add_argument("--intervalo-health", type=float, default=0.25, help="Segundos entre sondeos a /health")
+    parser.add_argument("--timeout", type=float, default=600, help="Timeout por solicitud en segundos")
+    parser.add_argument("--json", help="Guardar el resultado completo en este archivo")
+    return parser.parse_args()
+
+def generar_csv(filas):
+    """CSV sintético a partir de las filas de ejemplo, con NUMERO_GARANTIA único por fila"""
+    lineas = CSV_EJEMPLO.read_text(encoding="utf-8-sig").splitlines()
+    encabezado, datos = lineas[0], [l.split(";") for l in lineas[1:] if l.strip()]
+    indice_clave = encabezado.split(";").index("NUMERO_GARANTIA")
+    salida = [encabezado]
+    for i in range(filas):
+        fila = list(datos[i % len(datos)])
+        fila[indice_clave] = str(i + 1)
+        salida.append(";".join(fila))
+    return ("\n".join(salida) + "\n").encode("utf-8")
+
+def percentil(valores, p):
+    """Percentil por rango más cercano"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+def resumen_latencias(latencias):
+    return {
+        "p50_ms": _ms(percentil(latencias, 50)),
+        "p95_ms": _ms(percentil(latencias, 95)),
+        "p99_ms": _ms(percentil(latencias, 99)),
+        "max_ms": _ms(max(latencias) if latencias else None),
+    }
+
+def _ms(segundos):
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+def rss_bytes(pid):
+    """RSS del proceso y sus hijos (workers) en Linux; None si no se puede medir"""
+    try:
+        import psutil
+        proceso = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [proceso] + proceso.children(recursive=True))
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    total = 0
+    pendientes = [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            with open(f"/proc/{actual}/status") as f:
+                for linea in f:
+                    if linea.startswith("VmRSS:"):
+                        total += int(linea.split()[1]) * 1024
+            with open(f"/proc/{actual}/task/{actual}/children") as f:
+                pendientes.extend(int(h) for h in f.read().split())
+        except OSError:
+            if actual == pid:
+                return None
+    return total
+
+def iniciar_servidor(args, directorio_salida):
+    """Inicia api.py con uvicorn y espera a que /health responda"""
+    entorno = dict(os.environ, OUTPUT_DIR=directorio_salida)
+    comando = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1",
+               "--port", str(args.puerto), "--workers", str(args.workers), "--log-level", "warning"]
+    proceso = subprocess.Popen(comando, env=entorno, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{args.puerto}"
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError("El servidor terminó durante el arranque")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return proceso, base_url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El servidor no respondió a /health en 60 segundos")
+
+class Sondeo(threading.Thread):
+    """Sondea /health y la RSS del servidor mientras corre la carga"""
+
+    def __init__(self, base_url, intervalo, pid=None):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.intervalo = intervalo
+        self.pid = pid
+        self.latencias = []
+        self.errores = 0
+        self.rss = []
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.is_set():
+            inicio = time.perf_counter()
+            try:
+                respuesta = requests.get(f"{self.base_url}/health", timeout=30)
+                if respuesta.status_code == 200:
+                    self.latencias.append(time.perf_counter() - inicio)
+                else:
+                    self.errores += 1
+            except requests.exceptions.RequestException:
+                self.errores += 1
+            if self.pid:
+                rss = rss_bytes(self.pid)
+                if rss is not None:
+                    self.rss.append(rss)
+            self._detener.wait(self.intervalo)
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+def enviar(base_url, endpoint, contenido, numero, timeout):
+    """Envía una conversión y devuelve (latencia, ok, detalle)"""
+    data = {
+        "tipo_entidad": 1,
+        "codigo_entidad": str(100000 + numero),
+        "nombre_entidad": "PRUEBA_CARGA",
+        "fecha_corte": 2024,
+    }
+    files = {"csv_file": ("carga.csv", contenido, "text/csv")}
+    if endpoint == "convert":
+        files["schema_file"] = ("schema.json", SCHEMA.read_bytes(), "application/json")
+    inicio = time.perf_counter()
+    try:
+        respuesta = requests.post(f"{base_url}{ENDPOINTS[endpoint]}", data=data, files=files, timeout=timeout)
+        latencia = time.perf_counter() - inicio
+        ok = respuesta.status_code == 200 and respuesta.json().get("success", False)
+        return latencia, ok, None if ok else f"HTTP {respuesta.status_code}"
+    except requests.exceptions.RequestException as e:
+        return time.perf_counter() - inicio, False, type(e).__name__
+
+def ejecutar_escenario(base_url, endpoint, filas, args):
+    contenido = generar_csv(filas)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        resultados = list(pool.map(
+            lambda n: enviar(base_url, endpoint, contenido, n, args.timeout),
+            range(args.solicitudes)
+        ))
+    duracion = time.perf_counter() - inicio
+    latencias = [lat for lat, ok, _ in resultados if ok]
+    errores = [detalle for _, ok, detalle in resultados if not ok]
+    return {
+        "endpoint": ENDPOINTS[endpoint],
+        "filas": filas,
+        "bytes_csv": len(contenido),
+        "solicitudes": len(resultados),
+        "concurrencia": args.concurrencia,
+        "duracion_s": round(duracion, 2),
+        "throughput_rps": round(len(resultados) / duracion, 2) if duracion else None,
+        "filas_por_s": round(filas * len(latencias) / duracion) if duracion else None,
+        "tasa_error": round(len(errores) / len(resultados), 4) if resultados else None,
+        "errores": sorted(set(errores)),
+        **resumen_latencias(latencias),
+    }
+
+def imprimir_escenario(r):
+    print(f"\n📦 {r['endpoint']} · {r['filas']} filas ({r['bytes_csv'] / 1024:.0f} KB) · "
+          f"{r['solicitudes']} solicitudes, concurrencia {r['concurrencia']}")
+    print(f"   Latencia p50/p95/p99/max: {r['p50_ms']} / {r['p95_ms']} / {r['p99_ms']} / {r['max_ms']} ms")
+    print(f"   Throughput: {r['throughput_rps']} solicitudes/s ({r['filas_por_s']} filas/s)")
+    estado = "✅" if not r["tasa_error"] else "❌"
+    print(f"   {estado} Tasa de error: {r['tasa_error']:.2%} {r['errores'] if r['errores'] else ''}")
+
+def main():
+    args = parse_args()
+    tamanos = [int(f) for f in args.filas.split(",") if f.strip()]
+    endpoints = ["convert", "default"] if args.endpoint == "ambos" else [args.endpoint]
+
+    print("🧪 Prueba de carga del API CSV to AVRO")
+    print("=" * 50)
+
+    proceso = None
+    directorio_salida = tempfile.TemporaryDirectory(prefix="prueba_carga_")
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            pid = None
+            print(f"📡 Usando servidor existente: {base_url} (sin medición de RSS)")
+        else:
+            proceso, base_url = iniciar_servidor(args, directorio_salida.name)
+            pid = proceso.pid
+            print(f"📡 Servidor local iniciado en {base_url} (pid {pid}, {args.workers} workers)")
+
+        sondeo = Sondeo(base_url, args.intervalo_health, pid)
+        sondeo.start()
+        escenarios = []
+        try:
+            for endpoint in endpoints:
+                for filas in tamanos:
+                    resultado = ejecutar_escenario(base_url, endpoint, filas, args)
+                    escenarios.append(resultado)
+                    imprimir_escenario(resultado)
+        finally:
+            sondeo.detener()
+
+        salud = {
+            "sondeos": len(sondeo.latencias) + sondeo.errores,
+            "errores": sondeo.errores,
+            **resumen_latencias(sondeo.latencias),
+        }
+        memoria = {
+            "rss_max_mb": round(max(sondeo.rss) / 2**20, 1) if sondeo.rss else None,
+            "rss_promedio_mb": round(sum(sondeo.rss) / len(sondeo.rss) / 2**20, 1) if sondeo.rss else None,
+        }
+        print("\n🩺 /health durante la carga (bloqueo del event loop):")
+        print(f"   p50/p95/p99/max: {salud['p50_ms']} / {salud['p95_ms']} / {salud['p99_ms']} / {salud['max_ms']} ms"
+              f" · {salud['errores']} errores en {salud['sondeos']} sondeos")
+        if memoria["rss_max_mb"] is not None:
+            print(f"💾 RSS del servidor: máx {memoria['rss_max_mb']} MB, promedio {memoria['rss_promedio_mb']} MB")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"escenarios": escenarios, "health": salud, "memoria": memoria}, f, indent=2)
+            print(f"\n📝 Resultado guardado en {args.json}")
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            try:
+                proceso.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+        directorio_salida.cleanup()
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
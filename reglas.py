@@ -0,0 +1,177 @@
+import json
+import operator
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Nombre del archivo de reglas que se busca junto al esquema AVRO
+NOMBRE_ARCHIVO_REGLAS = "Reglas_AVRO.json"
+# Reglas del proyecto: se aplican cuando el esquema no trae las suyas (p. ej. uno subido a /convert)
+RUTA_REGLAS_PROYECTO = Path(os.environ.get("RUTA_REGLAS", NOMBRE_ARCHIVO_REGLAS))
+
+_OPERADORES = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+class _Contexto:
+    """Columnas de un bloque del CSV con conversiones numéricas memorizadas"""
+
+    def __init__(self, df):
+        self.df = df
+        self._numericas = {}
+
+    def texto(self, campo):
+        return self.df[campo]
+
+    def presente(self, campo):
+        return (self.df[campo] != '').to_numpy()
+
+    def numerica(self, campo):
+        if campo not in self._numericas:
+            self._numericas[campo] = pd.to_numeric(self.df[campo], errors='coerce').to_numpy(dtype='float64')
+        return self._numericas[campo]
+
+class ReglaCompilada:
+    """Regla lista para evaluarse: predicado vectorizado que marca las filas que la incumplen"""
+
+    def __init__(self, tipo, campo, campos, descripcion, predicado):
+        self.tipo = tipo
+        self.campo = campo
+        self.campos = campos
+        self.descripcion = descripcion
+        self.predicado = predicado
+
+    def evaluar(self, contexto):
+        return self.predicado(contexto)
+
+def _compilar_rango(regla):
+    campo = regla['campo']
+    minimo = regla.get('min')
+    maximo = regla.get('max')
+
+    def predicado(ctx):
+        valores = ctx.numerica(campo)
+        fallo = np.zeros(len(valores), dtype=bool)
+        # Los valores vacíos o no numéricos los reporta la validación de tipos
+        if minimo is not None:
+            fallo |= valores < minimo
+        if maximo is not None:
+            fallo |= valores > maximo
+        return fallo
+
+    return ReglaCompilada('rango', campo, [campo], f"rango [{minimo}, {maximo}]", predicado)
+
+def _compilar_regex(regla):
+    campo = regla['campo']
+    patron = regla['patron']
+    re.compile(patron)  # Error temprano si el patrón no es válido
+
+    def predicado(ctx):
+        texto = ctx.texto(campo)
+        coincide = texto.str.fullmatch(patron).fillna(False).to_numpy(dtype=bool)
+        return ctx.presente(campo) & ~coincide
+
+    return ReglaCompilada('regex', campo, [campo], f"patrón {patron}", predicado)
+
+def _compilar_no_nulo_si(regla):
+    campo = regla['campo']
+    si_campo = regla['si_campo']
+    valores = regla.get('valores')
+
+    def predicado(ctx):
+        if valores is None:
+            condicion = ctx.presente(si_campo)
+        else:
+            condicion = ctx.texto(si_campo).isin(valores).to_numpy()
+        return condicion & ~ctx.presente(campo)
+
+    if valores is None:
+        descripcion = f"obligatorio si {si_campo} tiene valor"
+    else:
+        descripcion = f"obligatorio si {si_campo} en {valores}"
+    return ReglaCompilada('no_nulo_si', campo, [campo, si_campo], descripcion, predicado)
+
+def _compilar_comparacion(regla):
+    campo = regla['campo']
+    otro_campo = regla['otro_campo']
+    simbolo = regla['operador']
+    if simbolo not in _OPERADORES:
+        raise ValueError(f"Operador no soportado en regla de comparación: {simbolo}")
+    comparar = _OPERADORES[simbolo]
+
+    def predicado(ctx):
+        izquierda = ctx.numerica(campo)
+        derecha = ctx.numerica(otro_campo)
+        # Solo se comparan filas con ambos valores; NaN hace falsa cualquier comparación
+        ambos = ~np.isnan(izquierda) & ~np.isnan(derecha)
+        return ambos & ~comparar(izquierda, derecha)
+
+    return ReglaCompilada('comparacion', campo, [campo, otro_campo], f"{campo} {simbolo} {otro_campo}", predicado)
+
+_COMPILADORES = {
+    'rango': _compilar_rango,
+    'regex': _compilar_regex,
+    'no_nulo_si': _compilar_no_nulo_si,
+    'comparacion': _compilar_comparacion,
+}
+
+class ConjuntoReglas:
+    """Reglas declarativas compiladas a predicados que se evalúan sobre bloques completos"""
+
+    def __init__(self, reglas):
+        self.reglas = [self._compilar(r) for r in reglas]
+
+    @staticmethod
+    def _compilar(regla):
+        tipo = regla.get('tipo')
+        if tipo not in _COMPILADORES:
+            raise ValueError(f"Tipo de regla no soportado: {tipo}")
+        return _COMPILADORES[tipo](regla)
+
+    @classmethod
+    def desde_archivo(cls, ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return cls(json.load(f).get('reglas', []))
+
+    def evaluar(self, df):
+        """
+        Evalúa todas las reglas sobre un DataFrame de textos.
+
+        Devuelve una lista de (regla, posiciones) con las posiciones de fila que la
+        incumplen. Las reglas que referencian columnas ausentes se omiten.
+        """
+        contexto = _Contexto(df)
+        resultados = []
+        for regla in self.reglas:
+            if any(c not in df.columns for c in regla.campos):
+                continue
+            posiciones = np.flatnonzero(regla.evaluar(contexto))
+            if len(posiciones):
+                resultados.append((regla, posiciones))
+        return resultados
+
+_CACHE_REGLAS = {}
+_CACHE_REGLAS_LOCK = threading.Lock()
+
+def cargar_reglas(ruta_reglas):
+    """Carga y compila un archivo de reglas, reutilizándolo mientras no cambie en disco"""
+    ruta = Path(ruta_reglas).resolve()
+    stat = ruta.stat()
+    clave = (stat.st_mtime_ns, stat.st_size)
+    with _CACHE_REGLAS_LOCK:
+        guardado = _CACHE_REGLAS.get(str(ruta))
+        if guardado and guardado[0] == clave:
+            return guardado[1]
+    reglas = ConjuntoReglas.desde_archivo(ruta)
+    with _CACHE_REGLAS_LOCK:
+        _CACHE_REGLAS[str(ruta)] = (clave, reglas)
+    return reglas
@@ -1,63 +1,177 @@
 #!/usr/bin/env python
 """
 Script para iniciar el servidor FastAPI del convertidor CSV a AVRO
+
+Modos de ejecución:
+    python start_server.py                       # Desarrollo (un proceso, recarga automática)
+    python start_server.py --produccion          # Producción (workers prefork, precarga)
+    python start_server.py --produccion --workers 8 --max-requests 500
 """
 
+import argparse
+import gc
+import os
+import time
+_INICIO_PROCESO = time.perf_counter()
+
 import uvicorn
 import sys
 from pathlib import Path
 
+def _modulo_disponible(nombre):
+    """Indica si un módulo opcional puede importarse"""
+    try:
+        __import__(nombre)
+        return True
+    except ImportError:
+        return False
+
+# uvloop y httptools vienen con uvicorn[standard]; en Windows no están disponibles
+LOOP = "uvloop" if _modulo_disponible("uvloop") else "auto"
+HTTP = "httptools" if _modulo_disponible("httptools") else "auto"
+
+def parse_args():
+    """Argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Servidor CSV to AVRO API")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--produccion", action="store_true",
+                        help="Modo producción: varios workers, precarga y sin recarga automática")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", os.cpu_count() or 1)),
+                        help="Número de workers en modo producción")
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("MAX_REQUESTS", 1000)),
+                        help="Solicitudes atendidas antes de reciclar un worker (0 = nunca)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.environ.get("MAX_REQUESTS_JITTER", 100)),
+                        help="Variación aleatoria para que los workers no se reciclen a la vez")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("WORKER_TIMEOUT", 600)),
+                        help="Segundos antes de reiniciar un worker bloqueado")
+    return parser.parse_args()
+
+def iniciar_produccion(args):
+    """
+    Inicia el servidor con gunicorn + workers uvicorn.
+
+    La aplicación se importa y precalienta en el proceso maestro (preload) antes
+    del fork, así los workers comparten por copy-on-write los módulos de pandas y
+    fastavro y el esquema ya parseado. Cada worker se recicla tras atender
+    --max-requests solicitudes para acotar el crecimiento de memoria.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        # gunicorn no existe en Windows: se usa el gestor de procesos de uvicorn,
+        # que arranca cada worker desde cero (sin precarga compartida). Ese gestor no
+        # reemplaza un worker que termina, así que aquí no se reciclan workers: con
+        # limit_max_requests cada worker saldría y el servidor dejaría de responder
+        print("⚠️  gunicorn no disponible, usando workers de uvicorn sin precarga ni reciclaje")
+        uvicorn.run(
+            "api:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop=LOOP,
+            http=HTTP,
+            log_level="info"
+        )
+        return
+
+    class AplicacionProduccion(BaseApplication):
+        def load_config(self):
+            opciones = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": "start_server.TrabajadorUvicorn",
+                "preload_app": True,
+                "max_requests": args.max_requests,
+                "max_requests_jitter": args.max_requests_jitter,
+                "timeout": args.timeout,
+                "graceful_timeout": 30,
+                "loglevel": "info",
+            }
+            for clave, valor in opciones.items():
+                self.cfg.set(clave, valor)
+
+        def load(self):
+            import api
+            arranque = api.precalentar()
+            # Mover los objetos ya creados a la generación permanente evita que el
+            # recolector de basura toque sus páginas en los workers y rompa el CoW
+            gc.freeze()
+            print(f"⏱️  Arranque en frío: {time.perf_counter() - _INICIO_PROCESO:.3f}s "
+                  f"(importación {arranque['importacion_s']}s, precalentamiento {arranque['precalentamiento_s']}s)")
+            return api.app
+
+    AplicacionProduccion().run()
+
+try:
+    from uvicorn.workers import UvicornWorker
+
+    class TrabajadorUvicorn(UvicornWorker):
+        """Worker de gunicorn que fuerza uvloop/httptools cuando están instalados"""
+        CONFIG_KWARGS = {"loop": LOOP, "http": HTTP}
+except ImportError:
+    TrabajadorUvicorn = None
+
 def main():
     """Función principal para iniciar el servidor"""
-    
+    args = parse_args()
+
     print("🚀 Iniciando servidor CSV to AVRO API")
     print("=" * 50)
-    
+
     # Verificar archivos necesarios
     required_files = [
         "generadorcsvavro.py",
         "api.py",
         "Esquema_AVRO.json"
     ]
-    
+
     missing_files = []
     for file in required_files:
         if not Path(file).exists():
             missing_files.append(file)
-    
+
     if missing_files:
         print("❌ Archivos faltantes:")
         for file in missing_files:
             print(f"   - {file}")
         print("\n   Asegúrate de que todos los archivos necesarios estén presentes.")
         sys.exit(1)
-    
+
     print("✅ Todos los archivos necesarios están presentes")
-    
+
     # Crear directorio de salida si no existe
     output_dir = Path("output")
     output_dir.mkdir(exist_ok=True)
     print(f"✅ Directorio de salida: {output_dir.absolute()}")
-    
+
     # Configuración del servidor
-    host = "0.0.0.0"
-    port = 8000
-    
+    host = args.host
+    port = args.port
+
     print(f"\n📡 Servidor iniciándose en: http://{host}:{port}")
     print(f"📖 Documentación disponible en: http://localhost:{port}/docs")
     print(f"📋 Documentación alternativa en: http://localhost:{port}/redoc")
+    if args.produccion:
+        # Solo gunicorn recicla workers (el respaldo de uvicorn no los reemplaza)
+        reciclaje = (f", reciclaje cada {args.max_requests} solicitudes"
+                     if args.max_requests and _modulo_disponible("gunicorn") else "")
+        print(f"🏭 Modo producción: {args.workers} workers, loop={LOOP}, http={HTTP}{reciclaje}")
     print("\n⚡ Para detener el servidor presiona Ctrl+C")
     print("=" * 50)
-    
+
     try:
-        # Iniciar servidor
-        uvicorn.run(
-            "api:app",
-            host=host,
-            port=port,
-            reload=True,  # Recarga automática en desarrollo
-            log_level="info"
-        )
+        if args.produccion:
+            iniciar_produccion(args)
+        else:
+            # Iniciar servidor
+            uvicorn.run(
+                "api:app",
+                host=host,
+                port=port,
+                reload=True,  # Recarga automática en desarrollo
+                log_level="info"
+            )
     except KeyboardInterrupt:
         print("\n\n👋 Servidor detenido por el usuario")
     except Exception as e:
@@ -121,6 +121,125 @@ def test_api():
     except Exception as e:
         print(f"❌ Error al probar conversión personalizada: {e}")
     
+    datos_base = {
+        'tipo_entidad': 1,
+        'codigo_entidad': '345678',
+        'nombre_entidad': 'TEST_SERIE',
+        'fecha_corte': 2024
+    }
+    lineas_csv = csv_file.read_bytes().splitlines(keepends=True)
+
+    # 6. Probar rechazo de claves duplicadas
+    print("\n6. Probando rechazo de claves duplicadas...")
+    try:
+        # La primera fila de datos repetida al final: misma NUMERO_GARANTIA + ID_CREDITO
+        contenido = b"".join(lineas_csv + [lineas_csv[1]])
+        files = {
+            'csv_file': ('duplicados.csv', contenido, 'text/csv')
+        }
+        
+        response = requests.post(f"{base_url}/convert-with-default-schema", files=files, data=datos_base)
+        
+        if response.status_code == 200:
+            result = response.json()
+            duplicadas = [inc for inc in result.get('inconsistencias') or [] if 'Clave duplicada' in inc]
+            if duplicadas:
+                print("✅ Clave duplicada rechazada:")
+                print(f"   - Registros válidos: {result.get('registros_validos', 0)}")
+                print(f"   - {duplicadas[0]}")
+            else:
+                print("❌ No se reportó la clave duplicada")
+        else:
+            print(f"❌ Error en conversión con duplicados: {response.status_code}")
+            print(f"   Respuesta: {response.text}")
+            
+    except Exception as e:
+        print(f"❌ Error al probar duplicados: {e}")
+    
+    # 7. Probar listado y descarga de archivos generados
+    print("\n7. Probando listado de archivos...")
+    try:
+        response = requests.get(f"{base_url}/files")
+        
+        if response.status_code == 200:
+            result = response.json()
+            print("✅ Archivos disponibles:")
+            print(f"   - Total de archivos: {result.get('total_archivos', 0)}")
+            print(f"   - Total de bytes: {result.get('total_bytes', 0)}")
+            if result.get('archivos'):
+                nombre = result['archivos'][0]['nombre']
+                descarga = requests.get(f"{base_url}/download/{nombre}")
+                if descarga.status_code == 200:
+                    print(f"✅ Descarga de {nombre}: {len(descarga.content)} bytes")
+                else:
+                    print(f"❌ Error al descargar {nombre}: {descarga.status_code}")
+        else:
+            print(f"❌ Error en listado de archivos: {response.status_code}")
+            
+    except Exception as e:
+        print(f"❌ Error al probar listado: {e}")
+    
+    # 8. Probar salida dividida en partes con manifiesto
+    print("\n8. Probando salida dividida en partes...")
+    try:
+        files = {
+            'csv_file': ('test.csv', open(csv_file, 'rb'), 'text/csv')
+        }
+        data = dict(datos_base, max_registros_por_parte=1)
+        
+        response = requests.post(f"{base_url}/convert-with-default-schema", files=files, data=data)
+        files['csv_file'][1].close()
+        
+        if response.status_code == 200:
+            result = response.json()
+            print("✅ Conversión por partes exitosa:")
+            print(f"   - Partes: {len(result.get('partes') or [])}")
+            print(f"   - Manifiesto: {result.get('manifest_file_path', 'N/A')}")
+            
+            manifiesto = requests.get(f"{base_url}/download/{result['manifest_file_path']}")
+            if manifiesto.status_code == 200:
+                partes = manifiesto.json()['partes']
+                faltantes = [p['archivo'] for p in partes
+                             if requests.get(f"{base_url}/download/{p['archivo']}").status_code != 200]
+                if faltantes:
+                    print(f"❌ Partes no descargables: {faltantes}")
+                else:
+                    print(f"✅ Manifiesto y {len(partes)} partes descargados")
+            else:
+                print(f"❌ Error al descargar el manifiesto: {manifiesto.status_code}")
+        else:
+            print(f"❌ Error en conversión por partes: {response.status_code}")
+            print(f"   Respuesta: {response.text}")
+            
+    except Exception as e:
+        print(f"❌ Error al probar partes: {e}")
+    
+    # 9. Probar conversión con progreso (SSE)
+    print("\n9. Probando conversión con progreso (SSE)...")
+    try:
+        files = {
+            'csv_file': ('test.csv', open(csv_file, 'rb'), 'text/csv')
+        }
+        
+        response = requests.post(f"{base_url}/convert-stream", files=files, data=datos_base, stream=True)
+        
+        if response.status_code == 200:
+            eventos = []
+            for linea in response.iter_lines(decode_unicode=True):
+                if linea and linea.startswith('event: '):
+                    eventos.append(linea[len('event: '):])
+            if 'progreso' in eventos and eventos[-1] == 'resultado':
+                print(f"✅ Stream completo: {len(eventos)} eventos ({', '.join(sorted(set(eventos)))})")
+            else:
+                print(f"❌ Stream incompleto: {eventos}")
+        else:
+            print(f"❌ Error en conversión con progreso: {response.status_code}")
+            print(f"   Respuesta: {response.text}")
+        files['csv_file'][1].close()
+            
+    except Exception as e:
+        print(f"❌ Error al probar progreso: {e}")
+    
     print("\n" + "=" * 50)
     print("🎉 Pruebas completadas!")
     print(f"📖 Documentación disponible en: {base_url}/docs")